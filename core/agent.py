@@ -1,50 +1,141 @@
 # core/agent.py
 from .ollama_backend import OllamaBackend
+from .retrieval import VectorIndex
+from .conversation import ConversationTree, MessageNode
+from .tracing import tracer
+from .personas import get_registry, DEFAULT_PERSONA
+from .attachments import MapReduce
 
 class AgentCore:
     """Agent核心 - 角色管理与对话逻辑"""
     
-    def __init__(self):
-        self.backend = OllamaBackend()
-        self.current_persona = "nova"
-        self.conversation_history = []
+    def __init__(self, backend=None):
+        self.backend = backend or OllamaBackend()
+        self.personas = get_registry()
+        self.current_persona = DEFAULT_PERSONA
+        self.tree = ConversationTree()
+        self.index = None
     
     def switch_persona(self, persona_id):
         """切换角色"""
-        valid_personas = ["nova", "byte", "muse", "oracle"]
-        if persona_id in valid_personas:
+        if persona_id in self.personas:
             self.current_persona = persona_id
-            self.conversation_history = []
+            self.tree = ConversationTree()
             return True
         return False
     
+    @property
+    def conversation_history(self):
+        """当前分支的消息列表（只读视图）"""
+        return self.tree.messages()
+    
     # ✅ 修复1：增加 persona_id 参数（默认使用当前角色）
     def get_persona_name(self, lang="zh", persona_id=None):
         """获取角色显示名称"""
         if persona_id is None:
             persona_id = self.current_persona
-            
-        names = {
-            "zh": {
-                "nova": "Nova • 全能助手",
-                "byte": "Byte • 代码专家", 
-                "muse": "Muse • 创意写手",
-                "oracle": "Oracle • 战略顾问"
-            },
-            "en": {
-                "nova": "Nova • General Assistant",
-                "byte": "Byte • Code Expert",
-                "muse": "Muse • Creative Writer",
-                "oracle": "Oracle • Strategy Advisor"
-            }
-        }
-        return names.get(lang, names["zh"]).get(persona_id, persona_id)
+        if persona_id not in self.personas:
+            return persona_id
+        return self.personas.get(persona_id).display_name(lang)
+    
+    def open_index(self, root, embed_model="nomic-embed-text"):
+        """打开（或新建）目录索引，供检索增强使用；后端在工作进程时索引也建在那边"""
+        opener = getattr(self.backend, "open_index", None)
+        if opener is not None:
+            self.index = opener(root, embed_model)
+        else:
+            self.index = VectorIndex(root, self.backend, embed_model=embed_model)
+        return self.index
     
     def chat(self, message, callback):
         """发起对话（流式）"""
-        self.conversation_history.append({"role": "user", "content": message})
-        return self.backend.chat_stream(self.conversation_history, self.current_persona, callback)
+        text, _ = self.reply(callback, self.add_user_message(message))
+        return text
+    
+    def add_user_message(self, message, images=None):
+        """把用户消息（可附带 base64 图片）接到当前分支末尾，返回新节点"""
+        return self.tree.append("user", message, self.current_persona, images)
+    
+    def reply(self, callback, parent=None):
+        """为 parent（默认当前 head）生成回复，只发送该分支自己的路径
+        
+        成功时回复作为 parent 的子节点写入对话树，返回 (文本, 节点)；出错时节点为 None
+        """
+        tree = self.tree  # 生成期间若清空/切换角色，回复仍记到原来的树上
+        persona = self.current_persona
+        parent = parent or tree.head
+        messages = parent.path()  # 直接传节点，dict 只在组装请求体时以 JSON 片段的形式出现
+        if self.index is not None and self.personas.get(persona).retrieval:
+            try:
+                with tracer.span("agent.retrieve", "agent"):
+                    context = self.index.build_context(parent.content)
+            except Exception:
+                context = ""  # 检索失败不影响正常对话
+            if context:
+                # 检索内容只附在本次请求里，不写入历史
+                messages[-1] = MessageNode("user", context + parent.content, images=parent.images)
+        
+        errors = []
+        def on_token(token, is_done):
+            if is_done and token:
+                errors.append(token)
+            callback(token, is_done)
+        
+        with tracer.span("agent.reply", "agent", persona=persona, depth=parent.depth):
+            text = self.backend.chat_stream(messages, persona, on_token)
+        if errors:
+            return text, None
+        return text, tree.add(parent, "assistant", text, persona)
+    
+    def reply_attachment(self, callback, parent, attachment, question, progress=None, parallel=2):
+        """针对大附件回答：分块并发提炼后合并，最终回答作为 parent 的子节点写入对话树"""
+        tree = self.tree
+        persona = self.current_persona
+        errors = []
+        def on_token(token, is_done):
+            if is_done and token:
+                errors.append(token)
+            callback(token, is_done)
+        
+        with tracer.span("agent.map_reduce", "agent", persona=persona, size=attachment.size):
+            text = MapReduce(self.backend, persona, parallel).run(attachment, question, on_token, progress)
+        if errors:
+            return text, None
+        return text, tree.add(parent, "assistant", text, persona)
+    
+    def prefill(self, draft="", cancelled=None):
+        """预填充即将发送的前缀：system + 当前分支 + 正在输入的草稿
+        
+        检索角色发送时会改写最后一条用户消息，草稿部分不参与预填充
+        """
+        persona = self.current_persona
+        messages = self.tree.path()
+        if draft and not (self.index is not None and self.personas.get(persona).retrieval):
+            messages.append(MessageNode("user", draft))
+        return self.backend.prefill(messages, persona, cancelled)
+    
+    def regenerate_target(self):
+        """重新生成：回到最近一条用户消息，返回它（新回复会成为兄弟分支）"""
+        node = self.tree.last("user")
+        if node is not None:
+            self.tree.switch(node)
+        return node
+    
+    def edit_target(self):
+        """编辑最近一条用户消息：回到它之前，下一条消息成为新分支"""
+        node = self.tree.last("user")
+        if node is not None:
+            self.tree.fork(node)
+        return node
+    
+    def switch_branch(self, index):
+        """切换到第 index 个分支末端（从 1 开始）"""
+        leaves = self.tree.leaves()
+        if 1 <= index <= len(leaves):
+            self.tree.switch(leaves[index - 1])
+            return True
+        return False
     
     def clear_history(self):
         """清空对话历史"""
-        self.conversation_history = []
\ No newline at end of file
+        self.tree = ConversationTree()
\ No newline at end of file
@@ -0,0 +1,189 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from .conversation import MessageNode
+from .personas import get_registry
+
+ATTACH_DIR = Path.home() / ".newhorizon" / "attachments"
+ATTACH_THRESHOLD = 20000   # 超过这个字符数的粘贴改走附件，不进入输入框
+DEFAULT_CTX = 2048         # 角色未配置 num_ctx 时按 Ollama 默认上下文估算
+
+MAP_PROMPT = (
+    "Below is part {index} of {total} of a larger document ({name}).\n"
+    "Extract everything in this part that is relevant to the request as concise notes. "
+    "If nothing is relevant, reply with \"(nothing relevant)\".\n\n"
+    "Request: {question}\n\n--- part {index}/{total} ---\n{chunk}"
+)
+COMBINE_PROMPT = (
+    "The notes below were extracted from consecutive parts of a larger document ({name}).\n"
+    "Merge them into one concise set of notes relevant to the request, keeping concrete details.\n\n"
+    "Request: {question}\n\n{notes}"
+)
+REDUCE_PROMPT = (
+    "The notes below were extracted from all {total} parts of a larger document ({name}).\n"
+    "Using these notes, answer the request.\n\n"
+    "Request: {question}\n\n{notes}"
+)
+
+
+class Attachment:
+    """落盘的大段输入（粘贴内容或文件）- 只保存路径，内容按块从磁盘读取"""
+
+    def __init__(self, path, name=None):
+        self.path = Path(path)
+        self.name = name or self.path.name
+        self.size = self.path.stat().st_size
+
+    def label(self):
+        if self.size >= 1024 * 1024:
+            return f"📎 {self.name} ({self.size / 1024 / 1024:.1f} MB)"
+        return f"📎 {self.name} ({self.size / 1024:.0f} KB)"
+
+
+def spool_text(text, name=None):
+    """把大段粘贴写入附件目录（按内容哈希命名，重复粘贴不重复写盘）"""
+    data = text.encode("utf-8")
+    digest = hashlib.sha1(data).hexdigest()
+    ATTACH_DIR.mkdir(parents=True, exist_ok=True)
+    path = ATTACH_DIR / f"{digest[:16]}.txt"
+    if not path.exists():
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return Attachment(path, name or f"paste-{digest[:8]}.txt")
+
+
+def attach_file(path):
+    """直接引用磁盘上的文件（不复制、不整体读入内存）"""
+    path = Path(path).expanduser()
+    if not path.is_file():
+        raise FileNotFoundError(str(path))
+    return Attachment(path)
+
+
+def iter_text_chunks(path, max_chars):
+    """按行流式切块；超长的单行（压缩过的日志、JSON 等）按字符切开"""
+    lines = []
+    size = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            while len(line) > max_chars:
+                if lines:
+                    yield "".join(lines)
+                    lines, size = [], 0
+                yield line[:max_chars]
+                line = line[max_chars:]
+            if size + len(line) > max_chars and lines:
+                yield "".join(lines)
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line)
+    if lines and "".join(lines).strip():
+        yield "".join(lines)
+
+
+def chunk_budget(persona, sample=""):
+    """每块可用的字符数：上下文减去输出预留与提示词开销，再按字符/token 比例换算"""
+    ctx = persona.num_ctx or DEFAULT_CTX
+    reserve = (persona.num_predict or 512) + len(persona.system_prompt) // 2 + 200
+    # 中日韩文本大约一个字一个 token，英文与代码大约 3~4 个字符一个 token
+    wide = sum(1 for ch in sample if ord(ch) > 0x2E80)
+    chars_per_token = 1.0 if sample and wide / len(sample) > 0.3 else 3.0
+    return max(1000, int((ctx - reserve) * chars_per_token))
+
+
+class MapReduce:
+    """大附件问答 - 分块并发提炼要点（有界并发），要点过多时逐级合并，最后流式输出回答
+
+    progress(phase, done, total)：phase 为 "map" 或 "combine"
+    """
+
+    def __init__(self, backend, persona, parallel=2):
+        self.backend = backend
+        self.persona_id = persona
+        self.persona = get_registry().get(persona)
+        self.parallel = max(1, parallel)
+        self.error = None
+
+    def run(self, attachment, question, callback, progress=None):
+        with open(attachment.path, "r", encoding="utf-8", errors="replace") as f:
+            sample = f.read(4096)
+        budget = chunk_budget(self.persona, sample)
+        total = sum(1 for _ in iter_text_chunks(attachment.path, budget))
+        name = attachment.name
+
+        prompts = (MAP_PROMPT.format(index=i, total=total, name=name, question=question, chunk=chunk)
+                   for i, chunk in enumerate(iter_text_chunks(attachment.path, budget), 1))
+        notes = self._map(prompts, total, "map", progress)
+
+        # 要点合起来仍超出一块的容量：相邻要点分组合并，直到放得下
+        while notes is not None and len(notes) > 1 and sum(len(n) for n in notes) > budget:
+            groups = _group(notes, budget)
+            if len(groups) == len(notes):
+                break  # 单条要点已接近上限，无法继续合并
+            prompts = (COMBINE_PROMPT.format(name=name, question=question, notes="\n\n".join(g)) for g in groups)
+            notes = self._map(prompts, len(groups), "combine", progress)
+
+        if notes is None:
+            callback(self.error, True)
+            return self.error
+        joined = "\n\n".join(f"[{i}] {note}" for i, note in enumerate(notes, 1))
+        prompt = REDUCE_PROMPT.format(total=total, name=name, question=question, notes=joined)
+        return self.backend.chat_stream([MessageNode("user", prompt)], self.persona_id, callback)
+
+    def _ask(self, index, prompt):
+        errors = []
+        def on_token(token, is_done):
+            if is_done and token:
+                errors.append(token)
+        text = self.backend.chat_stream([MessageNode("user", prompt)], self.persona_id, on_token)
+        return index, text, errors[0] if errors else None
+
+    def _map(self, prompts, total, phase, progress):
+        """并发执行一批独立请求，按原顺序返回结果；任一失败则返回 None（错误记在 self.error）"""
+        results = [None] * total
+        done = 0
+        self.error = None
+        if progress:
+            progress(phase, 0, total)
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            in_flight = set()
+            for index, prompt in enumerate(prompts):
+                # 在途请求数受限，切块生成器不会把整个文件提前读进内存
+                while len(in_flight) >= self.parallel:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    done += self._collect(finished, results)
+                    if progress:
+                        progress(phase, done, total)
+                if self.error:
+                    break
+                in_flight.add(pool.submit(self._ask, index, prompt))
+            for fut in in_flight:
+                done += self._collect([fut], results)
+                if progress:
+                    progress(phase, done, total)
+        return None if self.error else results
+
+    def _collect(self, futures, results):
+        count = 0
+        for fut in futures:
+            index, text, error = fut.result()
+            if error:
+                self.error = self.error or error
+            results[index] = text
+            count += 1
+        return count
+
+
+def _group(notes, budget):
+    """相邻要点按容量分组"""
+    groups = [[]]
+    size = 0
+    for note in notes:
+        if groups[-1] and size + len(note) > budget:
+            groups.append([])
+            size = 0
+        groups[-1].append(note)
+        size += len(note)
+    return groups
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from .ollama_backend import OllamaBackend
+
+CASSETTE_VERSION = 1
+
+
+def request_key(payload, fields=("model", "messages", "options")):
+    """请求指纹：对关键字段做规范化 JSON 后取哈希"""
+    data = {k: payload.get(k) for k in fields}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CassetteRecorder:
+    """录制 Ollama 流式响应：请求体 + 原始 NDJSON 行 + 相对时间戳，gzip 压缩存盘
+
+    文件格式（每行一个 JSON）：
+        {"version": 1, "request": {...}, "status": 200}
+        [距请求发出的秒数, "原始响应行"]
+        ...
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def record(self, payload, status, lines, started):
+        """包装响应行迭代器：边透传边记录，迭代结束（或中断）时写入文件"""
+        entries = []
+        complete = False
+        try:
+            for line in lines:
+                entries.append((round(time.monotonic() - started, 4), line))
+                yield line
+            complete = True
+        finally:
+            self._write(payload, status, entries, complete)
+
+    def _write(self, payload, status, entries, complete):
+        with self._lock:
+            self._seq += 1
+            name = f"{int(time.time())}-{self._seq:04d}-{request_key(payload)[:12]}.ndjson.gz"
+        header = {"version": CASSETTE_VERSION, "request": payload, "status": status, "complete": complete}
+        with gzip.open(self.directory / name, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for offset, line in entries:
+                raw = line.decode("utf-8") if isinstance(line, bytes) else line
+                f.write(json.dumps([offset, raw], ensure_ascii=False) + "\n")
+
+
+class Cassette:
+    def __init__(self, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            self.entries = [tuple(json.loads(line)) for line in f if line.strip()]
+        self.path = Path(path)
+        self.request = header["request"]
+        self.status = header.get("status", 200)
+        self.complete = header.get("complete", True)
+
+
+class _ReplayResponse:
+    """模拟 requests 流式响应，按录制时的时间间隔（可加速）吐出原始行"""
+
+    def __init__(self, cassette, speed):
+        self.cassette = cassette
+        self.speed = speed
+        self.status_code = cassette.status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} (replayed)", response=self)
+
+    def iter_lines(self):
+        started = time.monotonic()
+        for offset, raw in self.cassette.entries:
+            if self.speed > 0:
+                delay = offset / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield raw.encode("utf-8")
+        if not self.cassette.complete:
+            raise requests.exceptions.ConnectionError("recorded stream was interrupted (replayed)")
+
+
+class ReplayBackend(OllamaBackend):
+    """回放后端 - 用录制好的 cassette 代替真实 Ollama，结果可复现
+
+    speed=1.0 按原速回放，speed=10 加速 10 倍，speed=0 不等待
+    匹配顺序：完整请求指纹 → 仅消息内容 → 按录制顺序轮流使用
+    """
+
+    def __init__(self, directory, speed=1.0, model="qwen2.5:7b"):
+        self.cassettes = [Cassette(p) for p in sorted(Path(directory).glob("*.ndjson.gz"))]
+        self.speed = speed
+        self._by_key = {}
+        self._by_messages = {}
+        for cassette in self.cassettes:
+            self._by_key.setdefault(request_key(cassette.request), cassette)
+            self._by_messages.setdefault(request_key(cassette.request, ("messages",)), cassette)
+        self._next = 0
+        self._lock = threading.Lock()
+        super().__init__(model=model, base_url="replay://cassettes")
+
+    def check_connection(self):
+        return bool(self.cassettes)
+
+    def prefill(self, messages, persona, cancelled=None):
+        return False  # 回放不涉及 prompt 评估，预填充没有意义
+
+    def find(self, payload):
+        cassette = (self._by_key.get(request_key(payload))
+                    or self._by_messages.get(request_key(payload, ("messages",))))
+        if cassette is None and self.cassettes:
+            with self._lock:
+                cassette = self.cassettes[self._next % len(self.cassettes)]
+                self._next += 1
+        return cassette
+
+    def _open_stream(self, request, timeout):
+        cassette = self.find(request.to_payload())
+        if cassette is None:
+            raise requests.exceptions.ConnectionError("no cassettes to replay")
+        return _ReplayResponse(cassette, self.speed)
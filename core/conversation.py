@@ -0,0 +1,123 @@
+import itertools
+import json
+import sys
+import threading
+from .payload import encode_json
+
+_node_ids = itertools.count(1)
+_heads = {}  # role -> b'{"role":...,"content":'，各角色共用
+
+
+def _head(role):
+    head = _heads.get(role)
+    if head is None:
+        head = _heads[role] = b'{"role":' + encode_json(role) + b',"content":'
+    return head
+
+
+class MessageNode:
+    """对话树节点 - 创建后不再修改，各分支共享公共前缀
+
+    使用 __slots__ 且 role / persona 字符串驻留，长会话每轮只占一个紧凑记录；
+    正文保存为 str（中文按 2 字节/字，比 UTF-8 更省，读取无需解码），JSON 片段在组装请求时现场编码；
+    附带的图片（base64）只以编码好的 JSON 片段保存，不再重复编码。dict 形式只在 API 边界（to_dict）生成
+    """
+
+    __slots__ = ("id", "role", "persona", "parent", "depth", "content", "_images")
+
+    def __init__(self, role, content, parent=None, persona=None, images=None):
+        self.id = next(_node_ids)
+        self.role = sys.intern(role)
+        self.persona = sys.intern(persona) if persona else None
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.content = content
+        self._images = b',"images":' + encode_json(list(images)) if images else None
+
+    def path(self):
+        """从根到本节点的消息链（O(depth)）"""
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+    def descends_from(self, node):
+        """node 是否在本节点的路径上（含自身）"""
+        current = self
+        while current is not None and current.depth > node.depth:
+            current = current.parent
+        return current is node
+
+    @property
+    def has_images(self):
+        return self._images is not None
+
+    @property
+    def images(self):
+        """附带的图片（base64 列表；只在编辑、检索改写等少数路径解码）"""
+        return json.loads(self._images[len(b',"images":'):]) if self._images else []
+
+    def to_dict(self):
+        message = {"role": self.role, "content": self.content}
+        if self._images:
+            message["images"] = self.images
+        return message
+
+    @property
+    def json_fragment(self):
+        """本消息的 JSON 编码（正文现场编码，图片片段直接拼接）"""
+        return _head(self.role) + encode_json(self.content) + (self._images or b"") + b"}"
+
+
+class ConversationTree:
+    """对话树 - 编辑/重新生成产生分支，切换分支只移动 head 指针"""
+
+    def __init__(self):
+        self.head = None
+        self._leaves = {}  # 节点 id -> 没有子节点的节点（只跟踪分支末端，不为每个节点建子列表）
+        self._lock = threading.Lock()
+
+    def add(self, parent, role, content, persona=None, images=None):
+        """在 parent 下新增子节点；若 parent 正是当前 head 则前移 head"""
+        node = MessageNode(role, content, parent, persona, images)  # 编码正文不占用锁
+        with self._lock:
+            if parent is not None:
+                self._leaves.pop(parent.id, None)
+            self._leaves[node.id] = node
+            if self.head is parent:
+                self.head = node
+            return node
+
+    def append(self, role, content, persona=None, images=None):
+        return self.add(self.head, role, content, persona, images)
+
+    def path(self):
+        return self.head.path() if self.head else []
+
+    def messages(self):
+        """当前分支的 API 消息列表"""
+        return [node.to_dict() for node in self.path()]
+
+    def fork(self, node):
+        """回到 node 之前，下一条消息将成为 node 的兄弟分支"""
+        with self._lock:
+            self.head = node.parent
+
+    def switch(self, node):
+        with self._lock:
+            self.head = node
+
+    def last(self, role):
+        """当前分支上最近一条指定角色的消息"""
+        node = self.head
+        while node is not None and node.role != role:
+            node = node.parent
+        return node
+
+    def leaves(self):
+        """所有分支的末端节点（按创建顺序）"""
+        with self._lock:
+            return sorted(self._leaves.values(), key=lambda n: n.id)
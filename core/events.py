@@ -0,0 +1,126 @@
+import threading
+
+DROP = "drop"      # 落后超过缓冲区容量时丢弃最旧事件（记入 dropped）
+BUFFER = "buffer"  # 不丢事件：即将被覆盖的事件转存到订阅者自己的溢出队列
+
+
+class Subscription:
+    """事件总线的一个订阅者 - 拥有独立的读游标，按自己的节奏读取"""
+
+    def __init__(self, bus, policy, name):
+        self.bus = bus
+        self.policy = policy
+        self.name = name
+        self.cursor = 0       # 下一个要从环形缓冲区读取的事件序号
+        self.spill = []       # BUFFER 策略下被生产者转存的事件
+        self.dropped = 0
+
+    def poll(self, max_events=None):
+        """非阻塞读取积压事件（最多 max_events 条）"""
+        bus = self.bus
+        with bus._cond:
+            return self._take(max_events)
+
+    def wait(self, timeout=None, max_events=None):
+        """阻塞到有新事件或总线关闭（供独立线程中的消费者使用）"""
+        bus = self.bus
+        with bus._cond:
+            bus._cond.wait_for(lambda: self.spill or self.cursor < bus.seq or bus.closed, timeout)
+            return self._take(max_events)
+
+    def __iter__(self):
+        """逐条迭代直到总线关闭且事件读完"""
+        while True:
+            events = self.wait()
+            if not events and self.finished:
+                return
+            yield from events
+
+    def pending(self):
+        """是否还有未读事件（总线关闭也算，便于调用方及时摘除订阅）"""
+        return bool(self.spill) or self.cursor < self.bus.seq or self.bus.closed
+
+    @property
+    def finished(self):
+        return self.bus.closed and not self.spill and self.cursor >= self.bus.seq
+
+    def _take(self, max_events):
+        bus = self.bus
+        events = self.spill
+        self.spill = []
+        oldest = bus.seq - bus.capacity
+        if self.cursor < oldest:
+            self.dropped += oldest - self.cursor
+            self.cursor = oldest
+        end = bus.seq if max_events is None else min(bus.seq, self.cursor + max_events - len(events))
+        buffer = bus._buffer
+        while self.cursor < end:
+            events.append(buffer[self.cursor % bus.capacity])
+            self.cursor += 1
+        if max_events is not None and len(events) > max_events:
+            self.spill = events[max_events:]
+            events = events[:max_events]
+        return events
+
+
+class EventBus:
+    """单轮对话的事件总线 - 有界环形缓冲区，生产者（后端工作线程）从不等待消费者
+
+    事件为 (kind, payload)："token" / "done"（出错时附错误文本）/ "bind"（写入对话树的回复节点）
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.seq = 0          # 已发布事件数
+        self.closed = False
+        self.subscribers = []
+        self._buffer = [None] * capacity
+        self._cond = threading.Condition()
+
+    def subscribe(self, policy=BUFFER, name=""):
+        """新增订阅者，从本轮第一条仍在缓冲区内的事件开始读"""
+        with self._cond:
+            sub = Subscription(self, policy, name)
+            sub.cursor = max(0, self.seq - self.capacity)
+            self.subscribers.append(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._cond:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+
+    def publish(self, kind, payload=None):
+        with self._cond:
+            slot = self.seq % self.capacity
+            evicted = self.seq - self.capacity
+            if evicted >= 0:
+                for sub in self.subscribers:
+                    if sub.policy == BUFFER and sub.cursor == evicted:
+                        sub.spill.append(self._buffer[slot])
+                        sub.cursor += 1
+            self._buffer[slot] = (kind, payload)
+            self.seq += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def callback(self):
+        """适配 chat_stream 的 callback(token, is_done) 接口"""
+        def on_token(token, is_done):
+            self.publish("done" if is_done else "token", token)
+        return on_token
+
+    def consume(self, handler, policy=DROP, name=""):
+        """在独立的守护线程里按顺序把事件交给 handler（慢消费者不影响生产者和其他订阅者）"""
+        sub = self.subscribe(policy, name)
+
+        def run():
+            for kind, payload in sub:
+                handler(kind, payload)
+
+        threading.Thread(target=run, name=f"bus-{name or 'consumer'}", daemon=True).start()
+        return sub
@@ -0,0 +1,201 @@
+import atexit
+import base64
+import hashlib
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 可选依赖：没有 Pillow 时只能原样发送不太大的 PNG/JPEG
+    Image = None
+
+# 常见视觉模型的输入边长（按模型名前缀匹配），更大的图片送进去也会被服务端缩小
+IMAGE_SIZES = {
+    "moondream": 378,
+    "llava": 672,
+    "bakllava": 672,
+    "llama3.2-vision": 1120,
+    "minicpm-v": 1344,
+    "qwen2.5vl": 1024,
+    "gemma3": 896,
+}
+DEFAULT_IMAGE_SIZE = 1024
+RAW_LIMIT = 4 * 1024 * 1024   # 没有 Pillow 时允许原样发送的最大文件
+
+
+def image_size(model):
+    """视觉模型的输入边长"""
+    name = (model or "").lower()
+    for prefix, size in IMAGE_SIZES.items():
+        if name.startswith(prefix):
+            return size
+    return DEFAULT_IMAGE_SIZE
+
+
+def _sniff(data):
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if data.startswith(b"\xff\xd8"):
+        return "JPEG"
+    return None
+
+
+def _rotated(img):
+    """EXIF 方向标记需要旋转"""
+    try:
+        return img.getexif().get(0x0112, 1) != 1
+    except Exception:
+        return False
+
+
+def _encode(data, max_side, quality=85):
+    """解码 → 缩小到 max_side → 编码为 base64（在进程池里执行），返回 (base64, (宽, 高))"""
+    if Image is None:
+        return base64.b64encode(data).decode("ascii"), None
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        if max(img.size) <= max_side and fmt in ("PNG", "JPEG") and not _rotated(img):
+            # 已经足够小：原样发送，不重新压缩
+            return base64.b64encode(data).decode("ascii"), img.size
+        img.draft("RGB", (max_side, max_side))  # JPEG 直接按缩小的比例解码
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+        return base64.b64encode(out.getvalue()).decode("ascii"), img.size
+
+
+class ImageAttachment:
+    """待发送的图片 - 编码在后台进行，future 的结果为 (base64, (宽, 高))"""
+
+    def __init__(self, path, future):
+        self.path = Path(path)
+        self.name = self.path.name
+        self.future = future
+
+    @property
+    def ready(self):
+        return self.future.done()
+
+    @property
+    def error(self):
+        return self.future.exception() if self.future.done() else None
+
+    def payload(self):
+        return self.future.result()[0]
+
+    def label(self):
+        return f"🖼 {self.name}" + ("" if self.ready else " …")
+
+
+class ImageEncoder:
+    """图片编码器 - 解码、缩小与 base64 编码放在进程池里，不占用 Tk 主线程和 GIL
+
+    编码结果按 (内容哈希, 边长) 缓存，同一张图片再次附加（重新生成、编辑后重发）不重复编码；
+    已写入对话树的图片随节点的 JSON 片段保存，之后每轮请求直接拼接
+    """
+
+    def __init__(self, max_side=DEFAULT_IMAGE_SIZE, workers=2, cache_bytes=64 * 1024 * 1024, quality=85):
+        self.enabled = Image is not None
+        self.max_side = max_side
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.quality = quality
+        self._cache = OrderedDict()   # (sha1, 边长) -> (base64, 尺寸)
+        self._cached = 0
+        self._pool = None
+        self._running = set()   # 已交给进程池、尚未完成的编码任务
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def submit(self, path, max_side=None):
+        """开始编码，立即返回 ImageAttachment（读文件、哈希与编码都不在调用线程）"""
+        path = Path(path).expanduser()
+        if not path.is_file():
+            raise FileNotFoundError(str(path))
+        future = Future()
+        threading.Thread(target=self._prepare, args=(path, max_side or self.max_side, future),
+                         name="image-encode", daemon=True).start()
+        return ImageAttachment(path, future)
+
+    def close(self):
+        """关闭进程池：取消排队中的编码任务，不等待正在进行的任务"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            running = list(self._running)
+        for task in running:
+            task.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _prepare(self, path, max_side, future):
+        try:
+            data = path.read_bytes()
+            key = (hashlib.sha1(data).hexdigest(), max_side)
+            result = self._get(key)
+            if result is None:
+                if Image is None:
+                    # 没有 Pillow：无法解码缩放，只放行模型能直接读取的小文件
+                    if _sniff(data) is None or len(data) > RAW_LIMIT:
+                        raise ValueError("Pillow is required for this image (pip install Pillow)")
+                    result = _encode(data, max_side)
+                else:
+                    pool = self._executor()
+                    task = pool.submit(_encode, data, max_side, self.quality)
+                    with self._lock:
+                        self._running.add(task)
+                    try:
+                        result = task.result()
+                    except BrokenProcessPool:
+                        self._discard(pool)  # 子进程异常退出，下次重新创建进程池
+                        raise
+                    finally:
+                        with self._lock:
+                            self._running.discard(task)
+                self._put(key, result)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn：子进程不继承 Tk 与各线程的状态
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown()
+
+    def _get(self, key):
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+            return result
+
+    def _put(self, key, result):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = result
+            self._cached += len(result[0])
+            while self._cached > self.cache_bytes and len(self._cache) > 1:
+                _, (old, _) = self._cache.popitem(last=False)
+                self._cached -= len(old)
@@ -1,86 +1,270 @@
 import json
+import time
 import requests
+from .resilience import LatencyTracker, CircuitBreaker, backoff_delay
+from .tracing import tracer
+from .personas import get_registry
+from .payload import ChatRequest, select_model
+
+# 可安全重试的 HTTP 状态（服务端过载/重启中）
+RETRY_STATUS = {502, 503, 504}
+# 首 token 期限按未缓存的 prompt 放宽：CPU 推理时 prompt 评估每秒只有几十个 token
+PROMPT_BYTES_PER_SEC = 200.0
+
+class StopStream(Exception):
+    """由流式回调抛出：调用方已不需要后续 token，立即断开当前请求（服务端随之停止生成）"""
+
 
 class OllamaBackend:
     """Ollama 本地模型后端 - 完全免费"""
     
-    def __init__(self, model="qwen2.5:7b", base_url="http://localhost:11434"):
+    def __init__(self, model="qwen2.5:7b", base_url="http://localhost:11434", pool_maxsize=8, vision_model=None):
         self.model = model
+        self.vision_model = vision_model  # 对话里有图片时改用的模型
         self.api_url = f"{base_url}/api/chat"
         self.base_url = base_url
+        self.connect_timeout = 3.05
+        self.max_retries = 2
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        # 共享连接池：多个会话并发流式请求时复用 keep-alive 连接
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.recorder = None
+        self._last_prompt = {}  # 模型 -> 上次请求体各片段的哈希，用来估算服务端前缀缓存之外的新增部分
         self.is_available = self.check_connection()
     
     def check_connection(self):
         """检测Ollama服务是否可用"""
         try:
-            resp = requests.get(f"{self.base_url}/api/tags", timeout=3)
+            resp = self.http.get(f"{self.base_url}/api/tags", timeout=3)
             return resp.status_code == 200
         except:
             return False
     
     def get_system_prompt(self, persona):
-        """为不同角色生成专属system prompt"""
-        prompts = {
-            "nova": """You are Nova, a versatile and friendly AI assistant.
-- Personality: Warm, patient, logically clear
-- Expertise: General knowledge, problem solving, learning guidance
-- Tone: Professional yet approachable, like a trusted friend
-- Always respond in the same language as the user's query.""",
-            
-            "byte": """You are Byte, a senior full-stack development expert.
-- Personality: Rigorous, geek spirit, loves sharing best practices
-- Expertise: Python, system design, algorithm optimization, debugging
-- Tone: Technical with a touch of humor, avoids over-engineering
-- Always provide runnable code examples with comments when applicable.
-- Respond in the same language as the user's query.""",
-            
-            "muse": """You are Muse, a creative content generator with rich imagination.
-- Personality: Sensitive, imaginative, aesthetically perceptive
-- Expertise: Story writing, copywriting, poetry, character design
-- Tone: Poetic and elegant, good at creating vivid imagery
-- Always respond in the same language as the user's query.""",
-            
-            "oracle": """You are Oracle, a strategic business advisor.
-- Personality: Insightful, data-driven, forward-thinking
-- Expertise: Market analysis, product strategy, decision support
-- Tone: Concise, structured, actionable
-- Always respond in the same language as the user's query."""
-        }
-        return prompts.get(persona, prompts["nova"])
+        """角色专属 system prompt（定义见 personas/ 目录）"""
+        return get_registry().get(persona).system_prompt
+    
+    def embed(self, texts, model="nomic-embed-text"):
+        """批量生成文本向量（/api/embed）"""
+        resp = self.http.post(f"{self.base_url}/api/embed", json={"model": model, "input": texts}, timeout=120)
+        resp.raise_for_status()
+        return resp.json()["embeddings"]
     
     def chat_stream(self, messages, persona, callback):
-        """流式对话（逐块返回）"""
-        system_prompt = self.get_system_prompt(persona)
+        """流式对话（逐块返回）
         
-        payload = {
-            "model": self.model,
-            "messages": [{"role": "system", "content": system_prompt}] + messages,
-            "stream": True,
-            "options": {"temperature": 0.7}
-        }
+        messages 可以是 dict，也可以是提供 json_fragment 的对话树节点
+        输出中途断线/超时时从断点续写（assistant 预填充），已生成的 token 不重新生成；
+        回调抛出 StopStream 时断开连接，返回已生成的部分（不发完成标记）
+        """
+        persona = get_registry().get(persona)
+        request = ChatRequest(select_model(persona, messages, self.model, self.vision_model), persona, messages)
         
-        try:
-            with requests.post(self.api_url, json=payload, stream=True, timeout=120) as resp:
-                resp.raise_for_status()
-                full_response = ""
-                for line in resp.iter_lines():
-                    if line:
-                        chunk = json.loads(line)
-                        if "message" in chunk and "content" in chunk["message"]:
-                            token = chunk["message"]["content"]
-                            full_response += token
-                            callback(token, False)  # 流式更新
-                callback("", True)  # 完成标记
-                return full_response
-        except requests.exceptions.ConnectionError:
-            error = "❌ Ollama not running\nPlease start Ollama first:\n  macOS/Linux: ollama serve\n  Windows: Launch Ollama app"
-            callback(error, True)
-            return error
-        except requests.exceptions.Timeout:
-            error = "❌ Request timeout\nModel may be loading. Try again in 30 seconds."
+        # Ollama 连续失败时直接快速失败，不再让用户干等
+        if not self.breaker.allow():
+            error = (f"❌ Ollama unavailable\nSkipped after repeated failures, "
+                     f"retrying in {self.breaker.remaining():.0f}s.")
             callback(error, True)
             return error
-        except Exception as e:
-            error = f"❌ AI error: {str(e)}"
-            callback(error, True)
-            return error
\ No newline at end of file
+        
+        attempt = 0
+        patient = False  # 首 token 超时后改用冷启动期限、按整个 prompt 放宽，重试一次
+        partial = []  # 检查点：已输出的 token，跨重试保留
+        while True:
+            # 已有部分输出时改发续写请求，回调只会收到新增的 token
+            current = request.continuation("".join(partial)) if partial else request
+            emitted = len(partial)
+            try:
+                with tracer.span("backend.chat_stream", "backend", model=request.model, attempt=attempt,
+                                 resumed_chars=sum(map(len, partial))):
+                    full_response = self._stream_once(current, callback, partial, patient)
+                self.breaker.record_success()
+                callback("", True)  # 完成标记
+                return full_response
+            except StopStream:
+                self.breaker.record_success()
+                return "".join(partial)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, requests.exceptions.HTTPError) as e:
+                if len(partial) == emitted and self._is_read_timeout(e):
+                    # 连接正常，只是模型加载或 prompt 评估慢：不计入熔断，也不按原期限反复重发
+                    if not patient:
+                        patient = True
+                        continue
+                    self.breaker.record_success()
+                    error = self._error_message(e)
+                    callback(error, True)
+                    return error
+                retryable = self._is_retryable(e)
+                if not retryable:
+                    # 服务端有响应（如 404 模型不存在），说明服务在线
+                    self.breaker.record_success()
+                elif len(partial) == emitted:
+                    # 本次尝试没有任何输出才计入熔断；输出过程中断开说明服务本身在线
+                    self.breaker.record_failure()
+                if retryable and attempt < self.max_retries and self.breaker.allow():
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                error = self._error_message(e)
+                callback(error, True)
+                return error
+            except Exception as e:
+                self.breaker.record_failure()  # 放行后的每条出口都要记录结果，否则半开状态无人收尾
+                error = f"❌ AI error: {str(e)}"
+                callback(error, True)
+                return error
+    
+    def prefill(self, messages, persona, cancelled=None):
+        """预填充：以 num_predict=1 发送即将用到的前缀，让服务端提前完成 prompt 评估并缓存
+        
+        其余 options 与正式请求一致（num_ctx 不同会导致模型重新加载）；
+        失败只返回 False，不计入熔断与延迟统计。cancelled() 为真时尽早断开
+        """
+        # 只读检查：allow() 会在冷却期后转为半开，探测机会留给正式请求
+        if not self.is_available or self.breaker.state != CircuitBreaker.CLOSED:
+            return False
+        persona = get_registry().get(persona)
+        options = dict(persona.options, num_predict=1)
+        model = select_model(persona, messages, self.model, self.vision_model)
+        request = ChatRequest(model, persona, messages, options=options)
+        try:
+            with tracer.span("backend.prefill", "backend", model=request.model, messages=len(messages)):
+                with self._open_stream(request, (self.connect_timeout, 120.0)) as resp:
+                    resp.raise_for_status()
+                    for _ in resp.iter_lines():
+                        if cancelled is not None and cancelled():
+                            return False
+            return True
+        except requests.exceptions.RequestException:
+            return False
+    
+    def start_recording(self, directory):
+        """录制模式：之后每次流式请求都保存为 cassette（见 core/cassette.py）"""
+        from .cassette import CassetteRecorder
+        self.recorder = CassetteRecorder(directory)
+        return self.recorder
+    
+    def stop_recording(self):
+        self.recorder = None
+    
+    def _open_stream(self, request, timeout):
+        """发起 HTTP 流式请求，请求体分块写入（回放后端替换这一层）"""
+        return self.http.post(self.api_url, data=request.iter_body(), stream=True, timeout=timeout,
+                              headers={"Content-Type": "application/json"})
+    
+    def _uncached_bytes(self, request):
+        """请求体中与同一模型上次请求不同的部分（服务端 KV 前缀缓存之外、需要重新评估的量）"""
+        fragments = request.fragments()
+        hashes = [hash(f) for f in fragments]  # 只记哈希，不再保留一份历史的副本
+        previous = self._last_prompt.get(request.model, ())
+        self._last_prompt[request.model] = hashes
+        same = 0
+        for current, last in zip(hashes, previous):
+            if current != last:
+                break
+            same += 1
+        return sum(len(f) for f in fragments[same:])
+    
+    def _stream_once(self, request, callback, partial, patient=False):
+        """发起一次流式请求：首 token 与 token 间分别使用自适应超时
+        
+        首 token 期限在自适应值之上按未缓存的 prompt 大小放宽（长粘贴、大附件分块）；
+        patient 时改用冷启动期限并按整个请求体放宽。
+        已输出的 token 同时追加到 partial（续写时其中已有上次的输出），返回完整文本
+        """
+        model = request.model
+        resumed = len(partial)
+        uncached = self._uncached_bytes(request)
+        if patient:
+            first_token_timeout = 120.0 + request.body_size() / PROMPT_BYTES_PER_SEC
+        else:
+            first_token_timeout = (self.latency.deadline(model, "first_token", cold=120.0, floor=5.0)
+                                   + uncached / PROMPT_BYTES_PER_SEC)
+        started = time.monotonic()
+        t_post = tracer.now()
+        with self._open_stream(request, (self.connect_timeout, first_token_timeout)) as resp:
+            t_headers = tracer.now()
+            tracer.complete("http.connect", t_post, t_headers, "http", status=resp.status_code)
+            resp.raise_for_status()
+            last = started
+            t_first = None
+            lines = resp.iter_lines()
+            recorder = self.recorder
+            if recorder is not None:
+                lines = recorder.record(request.to_payload(), resp.status_code, lines, started)
+            for line in lines:
+                if line:
+                    chunk = json.loads(line)
+                    if chunk.get("done"):
+                        _trace_server_timings(chunk, t_first or tracer.now())
+                    if "message" in chunk and "content" in chunk["message"]:
+                        token = chunk["message"]["content"]
+                        now = time.monotonic()
+                        if len(partial) == resumed:
+                            # 收到 token 即说明服务可用：半开探测随后中途断开也能关闭熔断、继续续写
+                            self.breaker.record_success()
+                            t_first = tracer.now()
+                            tracer.complete("http.wait_first_token", t_headers, t_first, "http")
+                            self.latency.observe(model, "first_token", now - started)
+                            # 首 token 之后模型已在解码，收紧读超时
+                            _set_read_timeout(resp, self.latency.deadline(model, "inter_token", cold=30.0, floor=2.0))
+                        else:
+                            self.latency.observe(model, "inter_token", now - last)
+                        last = now
+                        partial.append(token)
+                        callback(token, False)  # 流式更新
+            if t_first is not None:
+                tracer.complete("http.decode", t_first, tracer.now(), "http", tokens=len(partial) - resumed)
+            return "".join(partial)
+    
+    @staticmethod
+    def _is_read_timeout(e):
+        """等待响应时读超时（连接已建立）；连接超时说明服务不可达，不在此列"""
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return False
+        return isinstance(e, requests.exceptions.ReadTimeout) or "Read timed out" in str(e)
+    
+    @staticmethod
+    def _is_retryable(e):
+        if isinstance(e, requests.exceptions.HTTPError):
+            return e.response is not None and e.response.status_code in RETRY_STATUS
+        return True
+    
+    @staticmethod
+    def _error_message(e):
+        if isinstance(e, requests.exceptions.Timeout) or "timed out" in str(e):
+            return "❌ Request timeout\nModel may be loading. Try again in 30 seconds."
+        if isinstance(e, requests.exceptions.ChunkedEncodingError):
+            return "❌ Connection lost mid-reply\nThe reply could not be resumed. Try again."
+        if isinstance(e, requests.exceptions.ConnectionError):
+            return "❌ Ollama not running\nPlease start Ollama first:\n  macOS/Linux: ollama serve\n  Windows: Launch Ollama app"
+        return f"❌ AI error: {str(e)}"
+
+
+def _trace_server_timings(chunk, t_first):
+    """把 Ollama 结束块里的服务端耗时（纳秒）补记为 span，以首 token 时刻对齐"""
+    if not tracer.enabled:
+        return
+    prompt_eval = chunk.get("prompt_eval_duration", 0)
+    load = chunk.get("load_duration", 0)
+    eval_ns = chunk.get("eval_duration", 0)
+    if load:
+        tracer.complete("server.load", t_first - prompt_eval - load, t_first - prompt_eval, "server")
+    if prompt_eval:
+        tracer.complete("server.prompt_eval", t_first - prompt_eval, t_first, "server",
+                        tokens=chunk.get("prompt_eval_count", 0))
+    if eval_ns:
+        tracer.complete("server.decode", t_first, t_first + eval_ns, "server", tokens=chunk.get("eval_count", 0))
+
+
+def _set_read_timeout(resp, seconds):
+    """调整已建立连接的读超时（尽力而为，取不到底层 socket 时保持原值）"""
+    try:
+        resp.raw._fp.fp.raw._sock.settimeout(seconds)
+    except (AttributeError, OSError):
+        pass
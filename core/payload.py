@@ -0,0 +1,104 @@
+import hashlib
+import json
+
+# 请求体分块上限：小片段先合并再写 socket，避免每条消息一次系统调用
+BODY_CHUNK_BYTES = 64 * 1024
+
+
+def encode_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_message(message):
+    """单条消息的 JSON 片段；对话树节点与 worker 收到的片段自带编码，普通 dict 现场编码"""
+    fragment = getattr(message, "json_fragment", None)
+    if fragment is not None:
+        return fragment
+    return encode_json(message)
+
+
+def _has_images(message):
+    if isinstance(message, dict):
+        return bool(message.get("images"))
+    flag = getattr(message, "has_images", None)
+    if flag is not None:
+        return flag
+    return b',"images":[' in encode_message(message)
+
+
+def has_images(messages):
+    """消息里是否带图片（对话树节点直接查标记，不编码也不解码）"""
+    return any(_has_images(m) for m in messages)
+
+
+def select_model(persona, messages, model, vision_model=None):
+    """本次请求使用的模型：角色指定的优先，带图片的对话改用视觉模型"""
+    if persona.model:
+        return persona.model
+    if vision_model and has_images(messages):
+        return vision_model
+    return model
+
+
+class ChatRequest:
+    """一次 /api/chat 请求 - 由各条消息的 JSON 片段拼接请求体，每个请求只编码一次"""
+
+    def __init__(self, model, persona, messages, options=None, stream=True):
+        self.model = model
+        self.persona = persona
+        self.messages = messages
+        self.options = options if options is not None else persona.options
+        self.stream = stream
+        self._fragments = None
+
+    def continuation(self, partial_text):
+        """续写请求：把已生成的部分作为最后一条 assistant 消息，模型从断点接着生成"""
+        messages = list(self.messages) + [{"role": "assistant", "content": partial_text}]
+        return ChatRequest(self.model, self.persona, messages, self.options, self.stream)
+
+    def _head(self):
+        return (b'{"model":' + encode_json(self.model)
+                + b',"stream":' + (b"true" if self.stream else b"false")
+                + b',"options":' + encode_json(self.options)
+                + b',"messages":[')
+
+    def fragments(self):
+        """请求体片段（system 片段来自角色缓存；首次调用时编码，之后计量、哈希与发送共用）"""
+        if self._fragments is None:
+            fragments = [self._head(), self.persona.system_fragment]
+            for message in self.messages:
+                fragments.append(b",")
+                fragments.append(encode_message(message))
+            fragments.append(b"]}")
+            self._fragments = fragments
+        return self._fragments
+
+    def iter_body(self):
+        """分块产出请求体，requests 会以 chunked 方式边产出边写入 socket"""
+        buffer = []
+        size = 0
+        for fragment in self.fragments():
+            buffer.append(fragment)
+            size += len(fragment)
+            if size >= BODY_CHUNK_BYTES:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+
+    def body(self):
+        return b"".join(self.fragments())
+
+    def body_size(self):
+        return sum(len(fragment) for fragment in self.fragments())
+
+    def digest(self):
+        """请求体哈希（逐片段计算，不拼接整个请求体）"""
+        h = hashlib.sha1()
+        for fragment in self.fragments():
+            h.update(fragment)
+        return h.hexdigest()
+
+    def to_payload(self):
+        """等价的 dict 形式（录制、回放等调试路径使用）"""
+        return json.loads(self.body())
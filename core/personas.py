@@ -0,0 +1,101 @@
+import json
+import threading
+from pathlib import Path
+from .payload import encode_json
+
+BUILTIN_DIR = Path(__file__).parent.parent / "personas"
+USER_DIR = Path.home() / ".newhorizon" / "personas"
+DEFAULT_PERSONA = "nova"
+
+
+class Persona:
+    """角色定义（来自 personas/*.json）"""
+
+    def __init__(self, data):
+        if not isinstance(data, dict) or not isinstance(data.get("names", {}), dict):
+            raise ValueError("persona definition must be an object with a names object")
+        self.id = data["id"]
+        self.order = data.get("order", 100)
+        self.names = data.get("names", {})
+        self.system_prompt = data["system_prompt"]
+        self.model = data.get("model")
+        self.tier = data.get("tier")  # 级联路由时固定使用 "small" 或 "large"，未设置则按消息自动选择
+        self.temperature = data.get("temperature", 0.7)
+        self.num_ctx = data.get("num_ctx")
+        self.num_predict = data.get("num_predict")
+        self.stop = data.get("stop") or []
+        self.retrieval = data.get("retrieval", False)
+        self.options = self._build_options()
+        # system 消息的 JSON 片段只编码一次，每轮请求直接拼接
+        self.system_fragment = encode_json({"role": "system", "content": self.system_prompt})
+
+    def _build_options(self):
+        """Ollama 请求 options，未配置的项交给服务端默认值"""
+        options = {"temperature": self.temperature}
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        if self.num_predict:
+            options["num_predict"] = self.num_predict
+        if self.stop:
+            options["stop"] = list(self.stop)
+        return options
+
+    def display_name(self, lang="zh"):
+        return self.names.get(lang) or self.names.get("zh") or self.id
+
+
+class PersonaRegistry:
+    """角色注册表 - 启动时加载一次，按 id 和显示名称建立索引
+
+    先读内置目录，再读 ~/.newhorizon/personas（同 id 覆盖内置定义）
+    """
+
+    def __init__(self, dirs=None):
+        self.personas = {}
+        for directory in dirs or (BUILTIN_DIR, USER_DIR):
+            self._load_dir(Path(directory))
+        self.personas = dict(sorted(self.personas.items(), key=lambda item: (item[1].order, item[0])))
+        self._by_name = {name: p.id for p in self.personas.values() for name in p.names.values()}
+        self._names = {}
+
+    def _load_dir(self, directory):
+        if not directory.is_dir():
+            return
+        for path in sorted(directory.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    persona = Persona(json.load(f))
+            except (OSError, ValueError, KeyError):
+                continue  # 单个定义损坏不影响其他角色
+            self.personas[persona.id] = persona
+
+    def __contains__(self, persona_id):
+        return persona_id in self.personas
+
+    def ids(self):
+        return list(self.personas)
+
+    def get(self, persona_id):
+        """按 id 取角色，未知 id 回退到默认角色"""
+        return self.personas.get(persona_id) or self.personas[DEFAULT_PERSONA]
+
+    def display_names(self, lang="zh"):
+        if lang not in self._names:
+            self._names[lang] = [p.display_name(lang) for p in self.personas.values()]
+        return self._names[lang]
+
+    def from_display_name(self, name, default=DEFAULT_PERSONA):
+        return self._by_name.get(name, default)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """全局角色注册表（首次使用时加载）"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PersonaRegistry()
+        return _registry
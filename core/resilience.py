@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+
+
+class LatencyTracker:
+    """按模型统计延迟（EWMA 均值 + 平均偏差），据此给出自适应超时"""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.stats = {}  # (model, kind) -> [均值, 偏差, 样本数]
+        self.last_used = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, kind, seconds):
+        with self._lock:
+            self.last_used[model] = time.monotonic()
+            entry = self.stats.get((model, kind))
+            if entry is None:
+                self.stats[(model, kind)] = [seconds, seconds / 2, 1]
+                return
+            mean, dev, count = entry
+            entry[0] = mean + self.alpha * (seconds - mean)
+            entry[1] = dev + self.alpha * (abs(seconds - mean) - dev)
+            entry[2] = count + 1
+
+    def is_warm(self, model, keep_alive=300):
+        """模型最近用过（Ollama 默认保留 5 分钟），视为已加载"""
+        last = self.last_used.get(model)
+        return last is not None and time.monotonic() - last < keep_alive
+
+    def deadline(self, model, kind, cold, floor, factor=4.0):
+        """超时 = 均值 + factor×偏差，限制在 [floor, cold] 之间；冷启动直接用 cold"""
+        with self._lock:
+            entry = self.stats.get((model, kind))
+        if entry is None or entry[2] < 3 or not self.is_warm(model):
+            return cold
+        mean, dev, _ = entry
+        return max(floor, min(cold, mean + factor * dev + floor))
+
+    def snapshot(self):
+        with self._lock:
+            return {f"{model}/{kind}": round(mean, 3) for (model, kind), (mean, _, _) in self.stats.items()}
+
+
+class CircuitBreaker:
+    """熔断器 - 连续失败后在冷却期内直接快速失败"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=15.0, probe_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行请求（冷却期过后放一个探测请求；探测迟迟没有结果时再放一个）"""
+        with self._lock:
+            now = time.monotonic()
+            if ((self.state == self.OPEN and now - self.opened_at >= self.reset_timeout) or
+                    (self.state == self.HALF_OPEN and now - self.probe_at >= self.probe_timeout)):
+                self.state = self.HALF_OPEN
+                self.probe_at = now
+                return True
+            return self.state == self.CLOSED
+
+    def remaining(self):
+        """距离下次探测还有多少秒"""
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """指数退避 + 全抖动（避免多个客户端同时重试）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,218 @@
+import base64
+import hashlib
+import heapq
+import json
+import math
+import os
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+
+# 只索引文本/代码文件，避免把二进制塞进向量库
+SOURCE_SUFFIXES = {
+    ".py", ".pyi", ".js", ".ts", ".tsx", ".jsx", ".java", ".kt", ".go", ".rs",
+    ".c", ".h", ".cpp", ".hpp", ".cs", ".rb", ".php", ".swift", ".scala",
+    ".sh", ".sql", ".md", ".rst", ".txt", ".toml", ".yaml", ".yml", ".json",
+    ".ini", ".cfg", ".html", ".css"
+}
+SKIP_DIRS = {".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv",
+             ".tox", ".mypy_cache", ".pytest_cache", "dist", "build"}
+MAX_FILE_BYTES = 1024 * 1024
+
+
+def iter_source_files(root):
+    """遍历目录，逐个产出可索引的源文件"""
+    root = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith("."))
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            if path.suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            try:
+                if path.stat().st_size > MAX_FILE_BYTES:
+                    continue
+            except OSError:
+                continue
+            yield path
+
+
+def iter_chunks(path, max_chars=1200, overlap_lines=2):
+    """流式切块：按行读取，凑够 max_chars 就产出一块 (起始行, 结束行, 文本)"""
+    lines = []
+    size = 0
+    start = 1
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f, 1):
+            lines.append(line)
+            size += len(line)
+            if size >= max_chars:
+                yield start, lineno, "".join(lines)
+                # 保留少量重叠行，避免函数被切断后丢失上下文
+                lines = lines[-overlap_lines:] if overlap_lines else []
+                size = sum(len(l) for l in lines)
+                start = lineno - len(lines) + 1
+    if lines and "".join(lines).strip():
+        yield start, start + len(lines) - 1, "".join(lines)
+
+
+def file_digest(path):
+    """文件内容哈希（mtime 变了但内容没变时免重算）"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _normalize(vec):
+    vec = array("f", vec)
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    for i in range(len(vec)):
+        vec[i] /= norm
+    return vec
+
+
+def _encode_vec(vec):
+    return base64.b64encode(vec.tobytes()).decode("ascii")
+
+
+def _decode_vec(data):
+    vec = array("f")
+    vec.frombytes(base64.b64decode(data))
+    return vec
+
+
+class VectorIndex:
+    """本地向量索引 - 基于 mtime/哈希的增量更新"""
+
+    def __init__(self, root, backend, embed_model="nomic-embed-text", index_dir=None,
+                 batch_size=16, concurrency=2):
+        self.root = Path(root).resolve()
+        self.backend = backend
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        index_dir = Path(index_dir) if index_dir else Path.home() / ".newhorizon" / "index"
+        key = hashlib.sha1(str(self.root).encode("utf-8")).hexdigest()[:12]
+        self.index_path = index_dir / f"{key}.json"
+        self.files = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("embed_model") != self.embed_model:
+            return  # 换了嵌入模型，旧向量不可比，整体重建
+        for rel, entry in data.get("files", {}).items():
+            for chunk in entry["chunks"]:
+                chunk["vec"] = _decode_vec(chunk["vec"])
+            self.files[rel] = entry
+
+    def save(self):
+        files = {}
+        for rel, entry in self.files.items():
+            files[rel] = {**entry, "chunks": [{**c, "vec": _encode_vec(c["vec"])} for c in entry["chunks"]]}
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"root": str(self.root), "embed_model": self.embed_model, "files": files}, f)
+        os.replace(tmp, self.index_path)
+
+    @property
+    def file_count(self):
+        return len(self.files)
+
+    def _changed_files(self):
+        """对比 mtime/大小，必要时再比哈希，产出需要重新嵌入的文件"""
+        seen = set()
+        for path in iter_source_files(self.root):
+            rel = path.relative_to(self.root).as_posix()
+            seen.add(rel)
+            st = path.stat()
+            entry = self.files.get(rel)
+            if entry and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                continue
+            digest = file_digest(path)
+            if entry and entry["sha1"] == digest:
+                entry["mtime"], entry["size"] = st.st_mtime, st.st_size
+                continue
+            yield rel, path, {"mtime": st.st_mtime, "size": st.st_size, "sha1": digest, "chunks": []}
+        for rel in list(self.files):
+            if rel not in seen:
+                del self.files[rel]
+
+    def _iter_batches(self, pending):
+        batch = []
+        for rel, path, entry in self._changed_files():
+            pending[rel] = entry
+            for start, end, text in iter_chunks(path):
+                batch.append((rel, start, end, text))
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch):
+        return batch, self.backend.embed([item[3] for item in batch], self.embed_model)
+
+    def update(self, progress=None):
+        """增量重建索引，返回本次重新嵌入的块数"""
+        pending = {}
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = set()
+            for batch in self._iter_batches(pending):
+                # 限制在途批次数，切块生成器不会跑到嵌入前面太远
+                if len(in_flight) >= self.concurrency * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    done += self._collect(finished, pending)
+                    if progress:
+                        progress(done)
+                in_flight.add(pool.submit(self._embed_batch, batch))
+            done += self._collect(in_flight, pending)
+        for entry in pending.values():
+            entry["chunks"].sort(key=lambda c: c["start"])
+        with self._lock:
+            self.files.update(pending)
+        self.save()
+        if progress:
+            progress(done)
+        return done
+
+    def _collect(self, futures, pending):
+        count = 0
+        for fut in futures:
+            batch, vectors = fut.result()
+            for (rel, start, end, text), vec in zip(batch, vectors):
+                pending[rel]["chunks"].append({"start": start, "end": end, "text": text, "vec": _normalize(vec)})
+                count += 1
+        return count
+
+    def search(self, query, k=4):
+        """余弦相似度检索，返回 [(分数, 路径, 起始行, 结束行, 文本)]"""
+        with self._lock:
+            if not self.files:
+                return []
+            files = list(self.files.items())
+        qvec = _normalize(self.backend.embed([query], self.embed_model)[0])
+        candidates = (
+            (sum(a * b for a, b in zip(qvec, chunk["vec"])), rel, chunk["start"], chunk["end"], chunk["text"])
+            for rel, entry in files for chunk in entry["chunks"]
+        )
+        return heapq.nlargest(k, candidates, key=lambda hit: hit[0])
+
+    def build_context(self, query, k=4, min_score=0.3):
+        """把检索结果拼成附加在提问前的上下文"""
+        hits = [h for h in self.search(query, k) if h[0] >= min_score]
+        if not hits:
+            return ""
+        parts = [f"# {rel} (L{start}-{end})\n{text.rstrip()}" for _, rel, start, end, text in hits]
+        return "Relevant local files:\n\n" + "\n\n".join(parts) + "\n\n---\n\n"
@@ -0,0 +1,195 @@
+import re
+import threading
+import time
+
+from .personas import get_registry
+from .resilience import LatencyTracker, CircuitBreaker
+from .tracing import tracer
+from .payload import has_images
+from .ollama_backend import StopStream
+
+SMALL, LARGE = "small", "large"
+
+# 代码特征：代码块、报错堆栈、定义与导入语句、行尾的花括号/分号、函数调用语句
+CODE_PATTERN = re.compile(
+    r"```|Traceback \(most recent call last\)|^\s*(def|class)\s+\w+.*:\s*$|"
+    r"^\s*(import\s+[\w.]+|from\s+[\w.]+\s+import\b|#include\b)|[{};]\s*$|\w\([^)]*\)\s*[{;]",
+    re.M,
+)
+# 小模型没把握时的常见措辞（只看回复开头 HEDGE_WINDOW 个字符）
+HEDGE_WINDOW = 240
+HEDGES = (
+    "i'm not sure", "i am not sure", "i'm not certain", "i don't know", "i do not know",
+    "i can't answer", "i cannot answer", "i'm unable", "i am unable", "as an ai",
+    "不确定", "我不知道", "无法回答", "不太清楚", "我不太确定", "无法确定",
+)
+
+
+def _content(message):
+    if isinstance(message, dict):
+        return message.get("content", "")
+    return message.content
+
+
+def hedged(text, head=HEDGE_WINDOW):
+    head = text[:head].lower()
+    return any(h in head for h in HEDGES)
+
+
+class _Hold:
+    """小模型的输出先缓冲：开头出现含糊措辞立即断开小模型；超过 limit 个字符仍无异常则开始正常流式输出"""
+
+    def __init__(self, callback, limit):
+        self.callback = callback
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.committed = False   # 已开始向调用方输出，不再升级
+        self.dropped = False     # 开头就没把握，已断开小模型
+        self.error = None
+
+    def __call__(self, token, is_done):
+        if self.committed:
+            self.callback(token, is_done)
+            return
+        if is_done:
+            self.error = token or None
+            return
+        self.parts.append(token)
+        self.size += len(token)
+        text = "".join(self.parts)
+        if hedged(text):
+            self.dropped = True
+            raise StopStream  # 不再等小模型写完，马上升级
+        if self.size > self.limit:
+            self.committed = True
+            self.callback(text, False)
+
+    def flush(self):
+        if self.parts:
+            self.callback("".join(self.parts), False)
+        self.callback("", True)
+
+
+class CascadeRouter:
+    """模型级联路由 - 简单消息交给小模型，复杂或小模型没把握的交给大模型
+
+    分级只用本地的廉价信号：最后一条用户消息的长度、角色、是否含代码、对话深度；
+    带图片的对话交给大模型一档（由它换用视觉模型）。
+    角色可以用 "tier" 固定档位，指定了 "model" 的角色不参与路由。
+    小模型回复的开头先缓冲：开头含糊其辞时立即断开并升级到大模型，为空或出错时同样升级；
+    小模型连续出错（例如没有拉取）时暂时全部走大模型。
+    其余属性和方法原样转发给大模型后端
+    """
+
+    def __init__(self, large, small, max_prompt_chars=400, max_depth=12, hold_chars=HEDGE_WINDOW):
+        self.tiers = {LARGE: large, SMALL: small}
+        self.max_prompt_chars = max_prompt_chars
+        self.max_depth = max_depth
+        self.hold_chars = hold_chars
+        self.latency = LatencyTracker()
+        self.small_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=300.0)
+        self.routed = {}      # (档位, 原因) -> 次数
+        self.escalated = {}   # 升级原因 -> 次数
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.tiers[LARGE], name)
+
+    def route(self, messages, persona):
+        """返回 (档位, 原因)"""
+        persona = get_registry().get(persona)
+        if persona.model:
+            return LARGE, "persona-model"
+        if has_images(messages):
+            return LARGE, "images"
+        if persona.tier in self.tiers:
+            return persona.tier, "persona"
+        text = _content(messages[-1]) if messages else ""
+        if len(text) > self.max_prompt_chars:
+            return LARGE, "length"
+        if CODE_PATTERN.search(text):
+            return LARGE, "code"
+        if len(messages) > self.max_depth:
+            return LARGE, "depth"
+        return SMALL, "simple"
+
+    def low_confidence(self, text):
+        """小模型的完整回复是否需要升级；返回原因或 None"""
+        if not text.strip():
+            return "empty"
+        if hedged(text):
+            return "hedge"
+        return None
+
+    def chat_stream(self, messages, persona, callback):
+        tier, reason = self.route(messages, persona)
+        if tier == SMALL and not self.small_breaker.allow():
+            tier, reason = LARGE, "small-unavailable"
+        self._count(self.routed, (tier, reason))
+        if tier == LARGE:
+            return self._run(LARGE, messages, persona, callback)
+
+        started = time.monotonic()
+        hold = _Hold(callback, self.hold_chars)
+        text = self._run(SMALL, messages, persona, hold)
+        if hold.committed:
+            self.small_breaker.record_success()
+            return text
+        if hold.error:
+            self.small_breaker.record_failure()
+            why = "error"
+        else:
+            self.small_breaker.record_success()
+            why = "hedge" if hold.dropped else self.low_confidence(text)
+        if why is None:
+            hold.flush()
+            return text
+
+        self._count(self.escalated, why)
+        with tracer.span("router.escalate", "router", reason=why, small_chars=hold.size):
+            text = self._run(LARGE, messages, persona, callback)
+        self.latency.observe("escalated", "total", time.monotonic() - started)
+        return text
+
+    def prefill(self, messages, persona, cancelled=None):
+        """预填充发送时会选中的那一档"""
+        tier, _ = self.route(messages, persona)
+        if self.small_breaker.state != CircuitBreaker.CLOSED:
+            tier = LARGE  # 不占用熔断器的探测机会，探测留给正式请求
+        return self.tiers[tier].prefill(messages, persona, cancelled)
+
+    def start_recording(self, directory):
+        for backend in self.tiers.values():
+            backend.start_recording(directory)
+
+    def stop_recording(self):
+        for backend in self.tiers.values():
+            backend.stop_recording()
+
+    def stats(self):
+        """各档位的请求数、升级次数与平均延迟（秒），用于调整阈值"""
+        with self._lock:
+            routed = {f"{tier}/{reason}": n for (tier, reason), n in self.routed.items()}
+            escalated = dict(self.escalated)
+        return {"routed": routed, "escalated": escalated, "latency": self.latency.snapshot()}
+
+    def _count(self, table, key):
+        with self._lock:
+            table[key] = table.get(key, 0) + 1
+
+    def _run(self, tier, messages, persona, callback):
+        """调用一档后端，并按档位记录首 token 与总耗时"""
+        started = time.monotonic()
+        first = []
+
+        def on_token(token, is_done):
+            if not first and not is_done:
+                first.append(True)
+                self.latency.observe(tier, "first_token", time.monotonic() - started)
+            callback(token, is_done)
+
+        with tracer.span("router.tier", "router", tier=tier):
+            text = self.tiers[tier].chat_stream(messages, persona, on_token)
+        self.latency.observe(tier, "total", time.monotonic() - started)
+        return text
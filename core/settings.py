@@ -10,11 +10,19 @@ class SettingsManager:
             "theme": "dark",
             "font_size": 11,
             "model": "qwen2.5:7b",
+            "embed_model": "nomic-embed-text",
             "language": "zh",
             "auto_scroll": True,
             "show_welcome": True,
             "music_enabled": False,
-            "music_volume": 0.3
+            "music_volume": 0.3,
+            "stall_threshold_ms": 200,
+            "prefill_while_typing": True,
+            "worker_process": False,
+            "map_parallel": 2,
+            "cascade_routing": False,
+            "cascade_model": "phi3:3.8b",
+            "vision_model": "llava:7b"
         }
         self.settings = self.load()
     
@@ -29,8 +37,9 @@ class SettingsManager:
         return self.defaults.copy()
     
     def save(self, settings=None):
+        """保存设置；传入的项合并到现有设置上，未出现的键保持原值"""
         if settings:
-            self.settings = settings
+            self.settings = {**self.settings, **settings}
         self.config_path.parent.mkdir(exist_ok=True)
         with open(self.config_path, 'w', encoding='utf-8') as f:
             json.dump(self.settings, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,99 @@
+import struct
+import time
+from multiprocessing import shared_memory
+
+# 头部：写入累计字节数 head、读取累计字节数 tail、数据区容量
+HEADER = struct.Struct("<QQQ")
+LENGTH = struct.Struct("<I")
+
+
+class ShmRing:
+    """单生产者单消费者的共享内存字节环形缓冲区
+
+    每条记录为 4 字节长度 + 数据；head 只由生产者写、tail 只由消费者写，
+    先写数据再推进计数器，因此两端无需加锁（同一端有多个线程时由调用方串行化）
+    """
+
+    def __init__(self, name=None, size=1 << 20):
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + size)
+            HEADER.pack_into(self.shm.buf, 0, 0, 0, size)
+        else:
+            self.shm = _attach(name)
+        self.capacity = HEADER.unpack_from(self.shm.buf, 0)[2]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _counters(self):
+        head, tail, _ = HEADER.unpack_from(self.shm.buf, 0)
+        return head, tail
+
+    def try_put(self, data):
+        """写入一条记录；空间不足时返回 False（不阻塞）"""
+        need = LENGTH.size + len(data)
+        if need > self.capacity:
+            raise ValueError(f"record of {len(data)} bytes exceeds ring capacity")
+        head, tail = self._counters()
+        if need > self.capacity - (head - tail):
+            return False
+        self._copy_in(head, LENGTH.pack(len(data)))
+        self._copy_in(head + LENGTH.size, data)
+        struct.pack_into("<Q", self.shm.buf, 0, head + need)
+        return True
+
+    def put(self, data, timeout=None):
+        """写入一条记录；缓冲区满时等待消费者读取（背压）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_put(data):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def get_all(self, max_records=None):
+        """读出当前所有完整记录（非阻塞）"""
+        head, tail = self._counters()
+        records = []
+        while tail < head and (max_records is None or len(records) < max_records):
+            size = LENGTH.unpack(self._copy_out(tail, LENGTH.size))[0]
+            records.append(self._copy_out(tail + LENGTH.size, size))
+            tail += LENGTH.size + size
+        if records:
+            struct.pack_into("<Q", self.shm.buf, 8, tail)
+        return records
+
+    def _copy_in(self, pos, data):
+        buf = self.shm.buf
+        offset = pos % self.capacity
+        first = min(len(data), self.capacity - offset)
+        buf[HEADER.size + offset:HEADER.size + offset + first] = data[:first]
+        if first < len(data):
+            buf[HEADER.size:HEADER.size + len(data) - first] = data[first:]
+
+    def _copy_out(self, pos, size):
+        buf = self.shm.buf
+        offset = pos % self.capacity
+        first = min(size, self.capacity - offset)
+        data = bytes(buf[HEADER.size + offset:HEADER.size + offset + first])
+        if first < size:
+            data += bytes(buf[HEADER.size:HEADER.size + size - first])
+        return data
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach(name):
+    """打开已有的共享内存，只有创建方负责 unlink
+
+    3.13 之前无法关闭资源追踪；spawn 出的子进程与创建方共用同一个追踪进程，重复登记无害
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,89 @@
+import threading
+from .personas import get_registry
+from .payload import ChatRequest, select_model
+
+
+class _Flight:
+    """一次正在进行的生成：已产出的 token 与当前订阅者"""
+
+    def __init__(self):
+        self.tokens = []
+        self.subscribers = []
+        self.finished = None      # 结束时的 (token, True)
+        self.result = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+
+class SingleFlightBackend:
+    """单飞合并 - 相同请求（模型、角色、历史、options）同时进行时只生成一次
+
+    后到的请求挂到正在进行的流上：先补发已产出的 token，再与首个请求一同接收后续 token
+    其余属性和方法原样转发给被包装的后端
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.collapsed = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def request_key(self, messages, persona):
+        """与 chat_stream 实际发出的请求体一致的指纹"""
+        persona = get_registry().get(persona)
+        model = select_model(persona, messages, self.backend.model, getattr(self.backend, "vision_model", None))
+        return ChatRequest(model, persona, messages).digest()
+
+    def chat_stream(self, messages, persona, callback):
+        key = self.request_key(messages, persona)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.collapsed += 1
+            with flight.lock:
+                # 在同一把锁内补发并登记，保证不漏也不重复
+                for token in flight.tokens:
+                    callback(token, False)
+                if flight.finished is None:
+                    flight.subscribers.append(callback)
+                else:
+                    callback(*flight.finished)
+
+        if not leader:
+            flight.done.wait()
+            return flight.result
+
+        def broadcast(token, is_done):
+            if is_done:
+                # 先摘除，之后到达的相同请求重新发起生成
+                with self._lock:
+                    self._flights.pop(key, None)
+            with flight.lock:
+                if is_done:
+                    flight.finished = (token, True)
+                else:
+                    flight.tokens.append(token)
+                for subscriber in flight.subscribers:
+                    subscriber(token, is_done)
+
+        try:
+            flight.result = self.backend.chat_stream(messages, persona, broadcast)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.lock:
+                if flight.finished is None:
+                    # 后端异常退出、没有发出完成标记：通知挂在这次生成上的其他请求
+                    flight.finished = ("❌ AI error: generation aborted", True)
+                    for subscriber in flight.subscribers[1:]:
+                        subscriber(*flight.finished)
+                    flight.result = flight.finished[0]
+            flight.done.set()
+        return flight.result
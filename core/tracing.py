@@ -0,0 +1,124 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+class _NullSpan:
+    """关闭追踪时共享的空 span，进入/退出都不做任何事"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.start, time.perf_counter_ns(), self.cat, **self.args)
+        return False
+
+    def set(self, **args):
+        """补充 span 参数（例如 token 数）"""
+        self.args.update(args)
+
+
+class Tracer:
+    """对话生命周期追踪 - 关闭时近乎零开销，可导出 Chrome trace-event 格式"""
+
+    def __init__(self, max_events=200000):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.hooks = []
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self._thread_names = {}
+
+    def span(self, name, cat="app", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, cat, args)
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def complete(self, name, start_ns, end_ns, cat="app", **args):
+        """记录一段已知起止时间的区间（纳秒，perf_counter_ns 时基）"""
+        if not self.enabled:
+            return
+        self._emit({"name": name, "cat": cat, "ph": "X",
+                    "ts": (start_ns - self.origin) / 1000, "dur": (end_ns - start_ns) / 1000, "args": args})
+
+    def instant(self, name, cat="app", **args):
+        if not self.enabled:
+            return
+        self._emit({"name": name, "cat": cat, "ph": "i", "s": "t",
+                    "ts": (time.perf_counter_ns() - self.origin) / 1000, "args": args})
+
+    def add_hook(self, hook):
+        """注册钩子：每条事件记录后以事件 dict 调用"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def _emit(self, event):
+        thread = threading.current_thread()
+        event["pid"] = self.pid
+        event["tid"] = thread.ident
+        self._thread_names.setdefault(thread.ident, thread.name)
+        self.events.append(event)
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception:
+                pass
+
+    def start(self):
+        self.events.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def export_chrome(self, path):
+        """导出为 Chrome trace-event JSON（chrome://tracing / Perfetto 可直接打开）"""
+        meta = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self._thread_names.items()]
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + list(self.events), "displayTimeUnit": "ms"}, f)
+        return path
+
+
+tracer = Tracer()
+
+
+def enable_from_env():
+    """设置环境变量 NHD_TRACE=<文件路径> 时启动追踪，并在退出时导出"""
+    path = os.environ.get("NHD_TRACE")
+    if path:
+        tracer.start()
+        atexit.register(tracer.export_chrome, path)
@@ -0,0 +1,334 @@
+import atexit
+import itertools
+import multiprocessing
+import struct
+import threading
+import time
+from pathlib import Path
+
+from .shm_ring import ShmRing
+from .ollama_backend import OllamaBackend, StopStream
+from .personas import get_registry
+from .payload import encode_message
+from .retrieval import VectorIndex
+
+# 共享内存里的流式记录：请求 id、类型、UTF-8 文本
+RECORD = struct.Struct("<IB")
+TOKEN, DONE = 0, 1
+WORKER_EXITED = "❌ Worker process exited"
+
+# GUI 进程可以远程调用的后端方法，以及工作进程里的目录索引操作
+WORKER_CALLS = {"embed", "check_connection", "prefill", "start_recording", "stop_recording",
+                "index_update", "index_context"}
+IDLE_WAIT = 1.0  # 没有进行中的调用时分发线程的休眠上限（秒），期间不再轮询
+
+
+class _Fragment:
+    """工作进程里代替对话树节点：只携带 GUI 进程已编码好的 JSON 片段"""
+
+    __slots__ = ("json_fragment",)
+
+    def __init__(self, fragment):
+        self.json_fragment = fragment
+
+
+def _worker_main(conn, ring_name, model, base_url, vision_model=None):
+    """工作进程入口：持有 OllamaBackend，token 写入共享内存，其余结果走 Pipe"""
+    ring = ShmRing(ring_name)
+    backend = OllamaBackend(model=model, base_url=base_url, vision_model=vision_model)
+    ring_lock = threading.Lock()   # 多个流式线程共用一个生产端
+    conn_lock = threading.Lock()
+    cancelled = set()
+    indexes = {}                   # (目录, 嵌入模型) -> VectorIndex，向量只存在于工作进程
+    index_lock = threading.Lock()
+
+    def emit(req_id, kind, text):
+        with ring_lock:
+            ring.put(RECORD.pack(req_id, kind) + text.encode("utf-8"))
+
+    def send(message):
+        with conn_lock:
+            conn.send(message)
+
+    def run_chat(req_id, fragments, persona):
+        messages = [_Fragment(f) for f in fragments]
+        def on_token(token, is_done):
+            if req_id in cancelled:
+                raise StopStream  # GUI 进程已放弃这次生成，断开请求
+            emit(req_id, DONE if is_done else TOKEN, token)
+        backend.chat_stream(messages, persona, on_token)
+        cancelled.discard(req_id)
+
+    def open_index(root, embed_model):
+        with index_lock:
+            index = indexes.get((root, embed_model))
+            if index is None:
+                index = indexes[(root, embed_model)] = VectorIndex(root, backend, embed_model=embed_model)
+            return index
+
+    def run_call(req_id, name, args):
+        try:
+            if name == "index_update":
+                index = open_index(*args)
+                result = (index.update(), len(index.files))
+            elif name == "index_context":
+                root, embed_model, query = args
+                result = open_index(root, embed_model).build_context(query)
+            elif name == "prefill":
+                messages, persona = args
+                result = backend.prefill([_Fragment(f) for f in messages], persona, lambda: req_id in cancelled)
+                cancelled.discard(req_id)
+            else:
+                result = getattr(backend, name)(*args)
+                if name in ("start_recording", "stop_recording"):
+                    result = None  # 录制器持有锁，不能经 Pipe 传回；录制只在工作进程里进行
+            send(("result", req_id, result))
+        except Exception as e:
+            send(("error", req_id, f"{type(e).__name__}: {e}"))
+
+    send(("ready", backend.is_available))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        command = message[0]
+        if command == "stop":
+            break
+        if command == "chat":
+            threading.Thread(target=run_chat, args=message[1:], daemon=True).start()
+        elif command == "call" and message[2] in WORKER_CALLS:
+            threading.Thread(target=run_call, args=message[1:], daemon=True).start()
+        elif command == "cancel":
+            cancelled.add(message[1])
+    ring.close()
+
+
+class _Pending:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.parts = []
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class RemoteIndex:
+    """工作进程里的目录索引在 GUI 进程的代理 - 与 VectorIndex 的 update / build_context 接口一致"""
+
+    def __init__(self, backend, root, embed_model):
+        self.backend = backend
+        self.root = root
+        self.embed_model = embed_model
+        self.file_count = 0
+
+    def update(self, progress=None):
+        count, self.file_count = self.backend._call("index_update", (self.root, self.embed_model))
+        if progress:
+            progress(count)
+        return count
+
+    def build_context(self, query, k=4, min_score=0.3):
+        return self.backend._call("index_context", (self.root, self.embed_model, query))
+
+
+class WorkerBackend:
+    """独立进程后端 - HTTP、NDJSON 解析、重试、嵌入与目录索引都在工作进程里执行
+
+    与 OllamaBackend 接口一致；流式 token 经共享内存环形缓冲区传回，
+    控制命令与非流式结果走 Pipe。GUI 进程只剩一个轻量的分发线程，
+    Tk 主循环不再与网络、解析、哈希和余弦检索争抢 GIL。
+    附件分块只是按块读文件，请求体在 GUI 进程编码（对话树在这边，编码由 C 实现），都留在本进程
+    """
+
+    def __init__(self, model="qwen2.5:7b", base_url="http://localhost:11434", ring_size=1 << 20, vision_model=None):
+        self.model = model
+        self.base_url = base_url
+        self.vision_model = vision_model
+        self.ring = ShmRing(size=ring_size)
+        # spawn：不继承 Tk 与各线程的状态，各平台行为一致
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, self.ring.name, model, base_url, vision_model),
+                                   name="newhorizon-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()   # 有新调用时唤醒空闲的分发线程
+        self._closed = False
+        self.is_available = False
+        try:
+            if self.conn.poll(30):
+                self.is_available = self.conn.recv()[1]
+        except (EOFError, OSError):
+            pass  # 工作进程启动即退出：读取线程随即让所有调用返回 WORKER_EXITED
+        self._reader = threading.Thread(target=self._read_loop, name="worker-reader", daemon=True)
+        self._reader.start()
+        atexit.register(self.close)
+
+    def get_system_prompt(self, persona):
+        return get_registry().get(persona).system_prompt
+
+    def chat_stream(self, messages, persona, callback):
+        """流式对话：消息片段在本进程编码（图片片段直接复用），发给工作进程执行"""
+        pending = self._register(_Pending(callback))
+        try:
+            self._send(("chat", pending.id, [encode_message(m) for m in messages], persona))
+        except OSError:
+            self._pending.pop(pending.id, None)
+            callback(WORKER_EXITED, True)
+            return WORKER_EXITED
+        pending.done.wait()
+        return pending.error or "".join(pending.parts)
+
+    def prefill(self, messages, persona, cancelled=None):
+        try:
+            return self._call("prefill", ([encode_message(m) for m in messages], persona), cancelled) or False
+        except (OSError, RuntimeError):
+            return False
+
+    def embed(self, texts, model="nomic-embed-text"):
+        return self._call("embed", (texts, model))
+
+    def open_index(self, root, embed_model="nomic-embed-text"):
+        """目录索引放在工作进程：切块、哈希、向量与检索都不占用 GUI 进程"""
+        return RemoteIndex(self, str(Path(root).resolve()), embed_model)
+
+    def check_connection(self):
+        try:
+            self.is_available = bool(self._call("check_connection", ()))
+        except (OSError, RuntimeError):
+            self.is_available = False
+        return self.is_available
+
+    def start_recording(self, directory):
+        self._call("start_recording", (directory,))
+
+    def stop_recording(self):
+        self._call("stop_recording", ())
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        try:
+            self._send(("stop",))
+        except OSError:
+            pass
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._reader.join(1)
+        self.ring.close()
+
+    # ---- 内部 ----
+
+    def _register(self, pending):
+        pending.id = next(self._ids)
+        self._pending[pending.id] = pending
+        self._wake.set()
+        return pending
+
+    def _send(self, message):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def _send_cancel(self, req_id):
+        try:
+            self._send(("cancel", req_id))
+        except OSError:
+            pass
+
+    def _call(self, name, args, cancelled=None):
+        """远程调用工作进程里的后端方法，阻塞到结果返回（可中途取消）"""
+        pending = self._register(_Pending())
+        try:
+            self._send(("call", pending.id, name, args))
+        except OSError:
+            self._pending.pop(pending.id, None)
+            raise
+        while not pending.done.wait(0.05):
+            if cancelled is not None and cancelled():
+                self._send(("cancel", pending.id))
+                cancelled = None
+        if pending.error:
+            raise RuntimeError(pending.error)
+        return pending.result
+
+    def _read_loop(self):
+        """分发线程：轮询共享内存里的 token 与 Pipe 里的结果，交给等待中的调用方"""
+        idle = 0
+        while not self._closed:
+            busy = False
+            for record in self.ring.get_all(256):
+                busy = True
+                req_id, kind = RECORD.unpack_from(record)
+                text = record[RECORD.size:].decode("utf-8")
+                pending = self._pending.get(req_id)
+                if pending is None:
+                    continue
+                if kind == TOKEN:
+                    pending.parts.append(text)
+                    try:
+                        pending.callback(text, False)
+                    except StopStream:
+                        # 调用方不再需要后续 token：通知工作进程断开，等待方立即返回
+                        self._abandon(pending)
+                    except Exception as e:
+                        # 回调出错只结束这一次调用，分发线程继续服务其他请求
+                        pending.error = f"❌ AI error: {e}"
+                        self._abandon(pending)
+                else:
+                    del self._pending[req_id]
+                    pending.error = text or None
+                    try:
+                        pending.callback(text, True)
+                    except Exception:
+                        pass
+                    pending.done.set()
+            try:
+                while self.conn.poll():
+                    busy = True
+                    status, req_id, value = self.conn.recv()
+                    pending = self._pending.pop(req_id, None)
+                    if pending is not None:
+                        if status == "result":
+                            pending.result = value
+                        else:
+                            pending.error = value
+                        pending.done.set()
+            except (EOFError, OSError):
+                self._fail_all(WORKER_EXITED)
+                return
+            if busy:
+                idle = 0
+                continue
+            if not self._pending:
+                # 没有进行中的调用：阻塞到下一次调用登记，不再每 10ms 醒来一次
+                self._wake.clear()
+                if not self._pending and not self._wake.wait(IDLE_WAIT) and not self.process.is_alive():
+                    self._fail_all(WORKER_EXITED)
+                    return
+                continue
+            idle += 1
+            if idle % 500 == 0 and not self.process.is_alive():
+                self._fail_all(WORKER_EXITED)
+                return
+            time.sleep(0.002 if idle < 50 else 0.01)  # 空闲越久轮询越稀
+
+    def _abandon(self, pending):
+        """放弃一次流式调用：通知工作进程断开，等待方立即返回"""
+        self._pending.pop(pending.id, None)
+        self._send_cancel(pending.id)
+        pending.done.set()
+
+    def _fail_all(self, error):
+        for pending in list(self._pending.values()):
+            self._pending.pop(pending.id, None)
+            pending.error = error
+            if pending.callback is not None:
+                pending.callback(error, True)
+            pending.done.set()
@@ -0,0 +1,285 @@
+import threading
+import time
+import tkinter as tk
+from collections import deque
+from tkinter import scrolledtext
+from core.tracing import tracer
+from core.events import BUFFER
+from .markdown_render import StreamingMarkdown
+
+ENDED = "❌ AI error: reply ended unexpectedly"
+
+
+class ChatSession:
+    """单个聊天标签页 - 独立的 AgentCore 状态、聊天区与待渲染事件队列
+
+    工作线程只往每轮的事件总线发布事件，本标签页订阅两次：
+    状态订阅每帧都处理（结束标记与节点绑定，后台标签页也及时解锁），
+    渲染订阅只在标签页可见时由主窗口的渲染循环按帧预算读取，后台期间 token 留在缓冲里
+    """
+
+    def __init__(self, gui, parent, agent):
+        self.gui = gui
+        self.agent = agent
+        self.frame = tk.Frame(parent, bg=gui.colors["border"], relief="flat", bd=1)
+        self.chat_display = scrolledtext.ScrolledText(
+            self.frame,
+            wrap=tk.WORD,
+            font=gui.font_chat,
+            bg=gui.colors["panel"],
+            fg=gui.colors["text"],
+            insertbackground=gui.colors["text"],
+            relief="flat",
+            padx=20,
+            pady=20,
+            spacing1=4,
+            spacing2=3,
+            spacing3=10
+        )
+        self.chat_display.pack(fill=tk.BOTH, expand=True, padx=1, pady=1)
+        self.chat_display.config(state=tk.DISABLED)
+        StreamingMarkdown.configure_tags(self.chat_display, gui.colors, gui.font_chat)
+        self.chat_display.tag_config("progress", foreground=gui.colors["muted"], lmargin1=24)
+
+        self.stream_md = None
+        self.attachment = None    # 待发送的大附件（内容在磁盘上，不进入输入框）
+        self.images = []          # 待发送的图片（在进程池里编码，发送时取结果）
+        self.attached = {}        # 附件消息节点 id -> (附件, 问题)：重新生成/编辑时再次分块阅读
+        self._progress = False
+        self.streaming = False
+        self.rendered_nodes = []  # 当前显示的分支路径（与对话树节点一一对应）
+        self.streams = deque()    # 正在渲染的各轮事件总线订阅（BUFFER 策略，不丢 token）
+        self.turns = deque()      # 各轮的状态订阅：只处理 done / bind
+        self._head_done = False   # 渲染队首是否已收到 done 事件
+        self._turn_done = False   # 状态队首是否已收到 done 事件
+        self.on_done = None
+        self.prefill_gen = 0      # 预填充代数：会话状态变化或发送时递增，过期的预填充自行放弃
+        self._prefill_after = None
+        self._prefilled = None
+
+    def listen(self, bus):
+        """订阅一轮回复的事件总线：渲染订阅按帧预算读取，状态订阅每帧处理"""
+        self.streams.append(bus.subscribe(BUFFER, "render"))
+        self.turns.append(bus.subscribe(BUFFER, "state"))
+
+    def pending(self):
+        return any(sub.pending() for sub in self.streams)
+
+    # ---- Tk 线程侧 ----
+
+    def sync(self):
+        """处理各轮的结束与节点绑定（不碰 token，开销与积压量无关）"""
+        turns = self.turns
+        while turns:
+            sub = turns[0]
+            for kind, payload in sub.poll():
+                if kind == "bind":
+                    self.bind_reply_node(payload)
+                elif kind == "done":
+                    self._finish_turn()
+            if not sub.finished:
+                return
+            turns.popleft()
+            if not self._turn_done:
+                self._finish_turn()  # 总线关闭却没有 done：本轮异常结束
+            self._turn_done = False
+
+    def _finish_turn(self):
+        self._turn_done = True
+        self.streaming = False
+        if self.on_done:
+            self.on_done(self)
+
+    def drain(self, deadline, max_merge=256):
+        """在截止时间前处理积压事件；每批读取的连续 token 合并成一次插入"""
+        streams = self.streams
+        while streams and time.perf_counter() < deadline:
+            sub = streams[0]
+            events = sub.poll(max_merge)
+            if not events:
+                if not sub.finished:
+                    return
+                streams.popleft()
+                if not self._head_done:
+                    # 总线关闭却没有 done：本轮异常结束，按失败处理
+                    self._handle_event("done", ENDED)
+                self._head_done = False
+                continue
+            parts = []
+            for kind, payload in events:
+                if kind == "token":
+                    parts.append(payload)
+                    continue
+                if parts:
+                    self.feed_stream("".join(parts))
+                    parts = []
+                self._handle_event(kind, payload)
+            if parts:
+                self.feed_stream("".join(parts))
+
+    def schedule_prefill(self, draft, delay_ms):
+        """输入停顿 delay_ms 后预填充当前前缀（每次按键重新计时）"""
+        self.cancel_prefill()
+        if self.streaming or draft.startswith("/"):
+            return
+        gen = self.prefill_gen
+        self._prefill_after = self.frame.after(delay_ms, lambda: self._fire_prefill(gen, draft))
+
+    def cancel_prefill(self):
+        self.prefill_gen += 1
+        if self._prefill_after is not None:
+            self.frame.after_cancel(self._prefill_after)
+            self._prefill_after = None
+
+    def _fire_prefill(self, gen, draft):
+        self._prefill_after = None
+        key = (id(self.agent.tree), self.agent.tree.head, self.agent.current_persona, draft)
+        if gen != self.prefill_gen or self.streaming or key == self._prefilled:
+            return
+        self._prefilled = key  # 前缀没变（例如只移动了光标）就不重复发送
+        threading.Thread(target=self.agent.prefill, args=(draft, lambda: gen != self.prefill_gen),
+                         daemon=True).start()
+
+    def _handle_event(self, kind, payload):
+        """渲染订阅的事件；done / bind 的状态部分由 sync 处理"""
+        if kind == "done":
+            self._head_done = True
+            self.end_stream_message(payload)
+        elif kind == "progress":
+            self.show_progress(payload)
+
+    def apply_theme(self):
+        gui = self.gui
+        self.frame.configure(bg=gui.colors["border"])
+        self.chat_display.configure(bg=gui.colors["panel"], fg=gui.colors["text"], font=gui.font_chat)
+        StreamingMarkdown.configure_tags(self.chat_display, gui.colors, gui.font_chat)
+        self.chat_display.tag_config("progress", foreground=gui.colors["muted"])
+
+    def clear(self):
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.delete("1.0", tk.END)
+        self.chat_display.config(state=tk.DISABLED)
+        self.agent.clear_history()
+        self.rendered_nodes = []
+
+    def show_path(self):
+        """显示当前分支：共享前缀保持不动，只删除并重绘分叉之后的部分（O(depth)）"""
+        path = self.agent.tree.path()
+        keep = 0
+        while (keep < len(self.rendered_nodes) and keep < len(path)
+               and self.rendered_nodes[keep] is path[keep]):
+            keep += 1
+
+        self.chat_display.config(state=tk.NORMAL)
+        if keep < len(self.rendered_nodes):
+            self.chat_display.delete(f"node{self.rendered_nodes[keep].id}", tk.END)
+            for node in self.rendered_nodes[keep:]:
+                self.chat_display.mark_unset(f"node{node.id}")
+        self.chat_display.config(state=tk.DISABLED)
+        self.rendered_nodes = self.rendered_nodes[:keep]
+
+        for node in path[keep:]:
+            self.render_node(node)
+
+    def render_node(self, node):
+        """渲染一条已记录在对话树中的消息，并用 mark 记住它的起点"""
+        self.chat_display.mark_set(f"node{node.id}", "end-1c")
+        self.chat_display.mark_gravity(f"node{node.id}", tk.LEFT)
+        if node.role == "user":
+            self.append_message("You", node.content, is_user=True)
+        else:
+            self.begin_stream_message(self.agent.get_persona_name(self.gui.current_lang, node.persona))
+            self.feed_stream(node.content)
+            self.end_stream_message()
+        self.rendered_nodes.append(node)
+
+    def bind_reply_node(self, node):
+        """流式回复写入对话树后，把它的起点 mark 绑定到节点"""
+        if not self.rendered_nodes or self.rendered_nodes[-1] is not node.parent:
+            return
+        self.chat_display.mark_set(f"node{node.id}", "reply_start")
+        self.chat_display.mark_gravity(f"node{node.id}", tk.LEFT)
+        self.rendered_nodes.append(node)
+
+    def begin_stream_message(self, sender):
+        """插入回复抬头，并为本次回复创建增量 Markdown 渲染器"""
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.mark_set("reply_start", "end-1c")
+        self.chat_display.mark_gravity("reply_start", tk.LEFT)
+        self.chat_display.insert(tk.END, f"\n│ {sender}\n")
+        self.chat_display.tag_add("sender", "end-2c linestart", "end-1c")
+        self.stream_md = StreamingMarkdown(self.chat_display, base_tags=("content",))
+        self.chat_display.config(state=tk.DISABLED)
+
+    def show_progress(self, text):
+        """回复正文开始前的进度行（原地更新，正文开始或结束时移除）"""
+        self.chat_display.config(state=tk.NORMAL)
+        if self._progress:
+            self.chat_display.delete("progress_start", "end-1c")
+        else:
+            self.chat_display.mark_set("progress_start", "end-1c")
+            self.chat_display.mark_gravity("progress_start", tk.LEFT)
+            self._progress = True
+        self.chat_display.insert("end-1c", f"⏳ {text}\n", ("progress",))
+        if self.gui.settings.get("auto_scroll", True):
+            self.chat_display.see(tk.END)
+        self.chat_display.config(state=tk.DISABLED)
+
+    def clear_progress(self):
+        if not self._progress:
+            return
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.delete("progress_start", "end-1c")
+        self.chat_display.mark_unset("progress_start")
+        self.chat_display.config(state=tk.DISABLED)
+        self._progress = False
+
+    def feed_stream(self, text):
+        if self.stream_md is None:
+            return
+        self.clear_progress()
+        with tracer.span("ui.render_token", "render", chars=len(text)):
+            self.chat_display.config(state=tk.NORMAL)
+            self.stream_md.feed(text)
+            if self.gui.settings.get("auto_scroll", True):
+                self.chat_display.see(tk.END)
+            self.chat_display.config(state=tk.DISABLED)
+
+    def end_stream_message(self, error_text=""):
+        """回复结束（出错时把错误信息一并显示）"""
+        if self.stream_md is None:
+            return
+        self.clear_progress()
+        with tracer.span("ui.render_end", "render"):
+            self.chat_display.config(state=tk.NORMAL)
+            if error_text:
+                self.stream_md.feed(error_text)
+            self.stream_md.finish()
+            self.stream_md = None
+            self.chat_display.insert(tk.END, "\n\n")
+            if self.gui.settings.get("auto_scroll", True):
+                self.chat_display.see(tk.END)
+            self.chat_display.config(state=tk.DISABLED)
+
+    def append_message(self, sender, text, is_user=False):
+        colors = self.gui.colors
+        self.chat_display.config(state=tk.NORMAL)
+
+        prefix = f"\n{'▌ ' if is_user else '│ '}{sender}\n"
+        prefix_color = colors["user_msg"] if is_user else colors["ai_msg"]
+
+        self.chat_display.insert(tk.END, prefix)
+        self.chat_display.tag_add("sender", "end-2c linestart", "end-1c")
+        self.chat_display.tag_config("sender", foreground=prefix_color, font=self.gui.font_main)
+
+        self.chat_display.insert(tk.END, f"{text}\n\n")
+        self.chat_display.tag_add("content", "end-3c linestart", "end-2c")
+        self.chat_display.tag_config("content",
+                                   foreground=colors["text"],
+                                   lmargin1=24,
+                                   lmargin2=24)
+
+        if self.gui.settings.get("auto_scroll", True):
+            self.chat_display.see(tk.END)
+
+        self.chat_display.config(state=tk.DISABLED)
@@ -1,18 +1,35 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, font, messagebox
+from tkinter import ttk, font, messagebox
 import os
 import threading
+import time
 from pathlib import Path
 from core.settings import SettingsManager
 from core.agent import AgentCore
+from core.ollama_backend import OllamaBackend
+from core.singleflight import SingleFlightBackend
+from core.worker import WorkerBackend
+from core.router import CascadeRouter
+from core.events import EventBus, DROP
+from core.attachments import ATTACH_THRESHOLD, spool_text, attach_file
+from core.images import ImageEncoder, image_size
+from core.personas import get_registry, DEFAULT_PERSONA
 from core.music import MusicPlayer
+from core.tracing import tracer
 from .settings_dialog import SettingsDialog
+from .chat_session import ChatSession
+from .watchdog import EventLoopWatchdog
+
+FRAME_MS = 16          # 渲染循环间隔
+RENDER_BUDGET = 0.008  # 每帧用于渲染可见标签页流式输出的时间（秒）
+LAG_GAUGE_MS = 500     # 事件循环延迟指示器刷新间隔
+PREFILL_DELAY_MS = 600 # 输入停顿多久后预填充 prompt 前缀
 
 
 class NewHorizonDesignGUI:
     """主窗口GUI"""
     
-    def __init__(self, root):
+    def __init__(self, root, backend=None):
         self.root = root
         self.root.title("NewHorizonDesign")
         self.root.geometry("900x650")
@@ -20,7 +37,20 @@ class NewHorizonDesignGUI:
         
         # 初始化核心模块
         self.settings = SettingsManager()
-        self.agent = AgentCore()
+        # 所有标签页共用一个后端（连接池）；相同请求同时进行时只生成一次
+        # worker_process 开启时网络与解析放到独立进程，token 经共享内存传回
+        # 外部注入的后端（性能回归测试用替身）原样使用
+        if backend is None:
+            make_backend = WorkerBackend if self.settings.get("worker_process") else OllamaBackend
+            backend = make_backend(vision_model=self.settings.get("vision_model"))
+            if self.settings.get("cascade_routing"):
+                # 简单消息先交给小模型，没把握时升级到大模型
+                backend = CascadeRouter(backend, make_backend(model=self.settings.get("cascade_model")))
+        self.backend = SingleFlightBackend(backend)
+        # 图片解码、缩小与 base64 编码在进程池里完成，缩到视觉模型的输入边长
+        self.image_encoder = ImageEncoder(max_side=image_size(self.settings.get("vision_model")))
+        self.personas = get_registry()
+        self.sessions = []
         self.current_lang = self.settings.get("language", "zh")
         
         # 初始化音乐（可选）
@@ -35,7 +65,7 @@ class NewHorizonDesignGUI:
                 "status_online": "● 在线（Ollama已连接）",
                 "persona_label": "当前角色:",
                 "send_btn": "发送消息",
-                "hint": "⏎ 发送  |  ⇧⏎ 换行  |  /clear 清空历史",
+                "hint": "⏎ 发送  |  ⇧⏎ 换行  |  /clear 清空历史  |  /index 目录 索引代码",
                 "settings_btn": "⚙️ 设置",
                 "music_btn": "🎵 音乐",
                 "music_disabled": "🎵 (需pygame)",
@@ -47,10 +77,15 @@ class NewHorizonDesignGUI:
 • Byte — 全栈开发专家  
 • Muse — 灵感创作伙伴
 • Oracle — 战略决策顾问
+• Flash — 简短快速的问答
 
 所有处理均通过本地Ollama完成 — 你的数据完全私有。
 
-💡 提示：按 ⏎ 发送消息，⇧⏎ 换行，输入 /clear 清空历史"""
+💡 提示：按 ⏎ 发送消息，⇧⏎ 换行，输入 /clear 清空历史
+🌿 分支：/regen 重新生成，/edit 改写上一问，/branches 查看分支，/branch n 切换
+🗂 标签页：/new 或 Ctrl+T 新建会话，/close 或 Ctrl+W 关闭（可同时进行多个对话）
+📎 附件：粘贴大段文本或 /attach 文件，分块阅读后回答
+🖼 图片：/image 图片文件，随下一条消息发给视觉模型"""
             },
             "en": {
                 "title": "🌌 NewHorizonDesign",
@@ -58,7 +93,7 @@ class NewHorizonDesignGUI:
                 "status_online": "● Online (Ollama connected)",
                 "persona_label": "Active Persona:",
                 "send_btn": "Send Message",
-                "hint": "⏎ Send  |  ⇧⏎ New line  |  /clear to clear history",
+                "hint": "⏎ Send  |  ⇧⏎ New line  |  /clear to clear history  |  /index <dir> to index code",
                 "settings_btn": "⚙️ Settings",
                 "music_btn": "🎵 Music",
                 "music_disabled": "🎵 (pygame required)",
@@ -70,10 +105,15 @@ Select a persona from the dropdown above to begin:
 • Byte — Full-stack development expert
 • Muse — Creative writing partner
 • Oracle — Strategic decision advisor
+• Flash — Short, fast answers
 
 All processing happens locally via Ollama — your data stays private.
 
-💡 Tip: Press ⏎ to send, ⇧⏎ for new line, type /clear to reset history"""
+💡 Tip: Press ⏎ to send, ⇧⏎ for new line, type /clear to reset history
+🌿 Branches: /regen to regenerate, /edit to rewrite the last question, /branches to list, /branch n to switch
+🗂 Tabs: /new or Ctrl+T opens a session, /close or Ctrl+W closes it (sessions can stream concurrently)
+📎 Attachments: paste a large text or /attach a file to have it read in parts
+🖼 Images: /image <file> sends a picture to the vision model with your next message"""
             }
         }
         
@@ -87,6 +127,26 @@ All processing happens locally via Ollama — your data stays private.
         # 显示欢迎消息
         if self.settings.get("show_welcome"):
             self.show_welcome()
+        
+        self.root.after(FRAME_MS, self._render_tick)
+        
+        # 事件循环看门狗：卡顿时采样主线程调用栈，写入 ~/.newhorizon/stalls.log
+        self.watchdog = EventLoopWatchdog(self.root, threshold_ms=self.settings.get("stall_threshold_ms", 200))
+        self.watchdog.start()
+        self.root.after(LAG_GAUGE_MS, self._update_lag_gauge)
+    
+    @property
+    def session(self):
+        """当前标签页"""
+        selected = self.notebook.select()
+        for session in self.sessions:
+            if str(session.frame) == selected:
+                return session
+        return self.sessions[0]
+    
+    @property
+    def agent(self):
+        return self.session.agent
     
     def load_theme(self):
         theme = self.settings.get("theme", "dark")
@@ -97,14 +157,18 @@ All processing happens locally via Ollama — your data stays private.
                 "bg": "#1a1a1a", "panel": "#252526", "border": "#3e3e42", "text": "#e0e0e0",
                 "muted": "#888888", "accent": "#007acc", "accent_hover": "#0099ff",
                 "user_msg": "#3ab370", "ai_msg": "#569cd6", "status_online": "#4caf50",
-                "status_offline": "#f44336", "music_active": "#ff6b6b"
+                "status_offline": "#f44336", "music_active": "#ff6b6b",
+                "code_bg": "#1e1e1e", "code_text": "#ce9178", "hl_keyword": "#c586c0",
+                "hl_string": "#ce9178", "hl_comment": "#6a9955", "hl_number": "#b5cea8"
             }
         else:
             self.colors = {
                 "bg": "#f5f5f5", "panel": "#ffffff", "border": "#e0e0e0", "text": "#333333",
                 "muted": "#777777", "accent": "#0066cc", "accent_hover": "#0088ff",
                 "user_msg": "#2e7d32", "ai_msg": "#1565c0", "status_online": "#2e7d32",
-                "status_offline": "#c62828", "music_active": "#e53935"
+                "status_offline": "#c62828", "music_active": "#e53935",
+                "code_bg": "#f0f0f0", "code_text": "#a31515", "hl_keyword": "#0000ff",
+                "hl_string": "#a31515", "hl_comment": "#008000", "hl_number": "#098658"
             }
         
         if os.name == 'nt':
@@ -158,13 +222,8 @@ All processing happens locally via Ollama — your data stays private.
         self.role_label.pack(side=tk.LEFT, padx=(0, 8))
         
         # ✅ 修复：正确生成角色显示名称列表
-        role_names = [
-            self.agent.get_persona_name(self.current_lang, "nova"),
-            self.agent.get_persona_name(self.current_lang, "byte"),
-            self.agent.get_persona_name(self.current_lang, "muse"),
-            self.agent.get_persona_name(self.current_lang, "oracle")
-        ]
-        self.role_var = tk.StringVar(value=self.agent.get_persona_name(self.current_lang))
+        role_names = self.personas.display_names(self.current_lang)
+        self.role_var = tk.StringVar(value=self.personas.get(DEFAULT_PERSONA).display_name(self.current_lang))
         self.role_combo = ttk.Combobox(
             role_frame,
             textvariable=self.role_var,
@@ -250,26 +309,19 @@ All processing happens locally via Ollama — your data stays private.
                        selectforeground="white",
                        bordercolor=self.colors["border"])
         
-        # 聊天区域
-        chat_frame = tk.Frame(main_frame, bg=self.colors["border"], relief="flat", bd=1)
-        chat_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 16))
+        style.configure("TNotebook", background=self.colors["bg"], borderwidth=0)
+        style.configure("TNotebook.Tab", background=self.colors["bg"], foreground=self.colors["muted"],
+                        bordercolor=self.colors["border"], padding=(12, 4))
+        style.map("TNotebook.Tab",
+                  background=[("selected", self.colors["panel"])],
+                  foreground=[("selected", self.colors["text"])])
         
-        self.chat_display = scrolledtext.ScrolledText(
-            chat_frame,
-            wrap=tk.WORD,
-            font=self.font_chat,
-            bg=self.colors["panel"],
-            fg=self.colors["text"],
-            insertbackground=self.colors["text"],
-            relief="flat",
-            padx=20,
-            pady=20,
-            spacing1=4,
-            spacing2=3,
-            spacing3=10
-        )
-        self.chat_display.pack(fill=tk.BOTH, expand=True, padx=1, pady=1)
-        self.chat_display.config(state=tk.DISABLED)
+        # 聊天区域（多标签页，每页一个独立会话）
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.pack(fill=tk.BOTH, expand=True, pady=(0, 16))
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
+        self.root.bind("<Control-t>", lambda e: self.new_session())
+        self.root.bind("<Control-w>", lambda e: self.session.streaming or self.close_session(self.session))
         
         # 输入区域
         input_frame = tk.Frame(main_frame, bg=self.colors["bg"])
@@ -295,6 +347,8 @@ All processing happens locally via Ollama — your data stays private.
         
         self.input_box.bind('<Return>', self.on_send_key)
         self.input_box.bind('<Shift-Return>', lambda e: self.input_box.insert(tk.END, '\n'))
+        self.input_box.bind('<KeyRelease>', self.on_input_key)
+        self.input_box.bind('<<Paste>>', self.on_paste)
         
         toolbar = tk.Frame(input_frame, bg=self.colors["bg"])
         toolbar.pack(fill=tk.X, pady=(8, 0))
@@ -308,6 +362,27 @@ All processing happens locally via Ollama — your data stays private.
         )
         self.hint_label.pack(side=tk.LEFT)
         
+        self.lag_label = tk.Label(
+            toolbar,
+            text="",
+            font=self.font_status,
+            fg=self.colors["muted"],
+            bg=self.colors["bg"]
+        )
+        self.lag_label.pack(side=tk.LEFT, padx=(12, 0))
+        
+        # 待发送附件（点击移除）
+        self.attach_label = tk.Label(
+            toolbar,
+            text="",
+            font=self.font_status,
+            fg=self.colors["accent"],
+            bg=self.colors["bg"],
+            cursor="hand2"
+        )
+        self.attach_label.pack(side=tk.LEFT, padx=(12, 0))
+        self.attach_label.bind("<Button-1>", lambda e: self.clear_attachments())
+        
         self.send_btn = tk.Button(
             toolbar,
             text=self.i18n[self.current_lang]["send_btn"],
@@ -324,10 +399,12 @@ All processing happens locally via Ollama — your data stays private.
         self.send_btn.bind("<Enter>", lambda e: self.send_btn.config(bg=self.colors["accent_hover"]))
         self.send_btn.bind("<Leave>", lambda e: self.send_btn.config(bg=self.colors["accent"])
         )
+        
+        self.new_session()
     
     def update_status(self):
         """更新Ollama连接状态"""
-        if self.agent.backend.is_available:
+        if self.backend.is_available:
             self.status_label.config(
                 text=self.i18n[self.current_lang]["status_online"],
                 fg=self.colors["status_online"]
@@ -365,7 +442,8 @@ All processing happens locally via Ollama — your data stays private.
         
         self.load_theme()
         self.root.configure(bg=self.colors["bg"])
-        self.chat_display.configure(bg=self.colors["panel"], fg=self.colors["text"], font=self.font_chat)
+        for session in self.sessions:
+            session.apply_theme()
         self.input_box.configure(bg=self.colors["panel"], fg=self.colors["text"], font=self.font_main)
         self.update_ui_language(old_lang, new_lang)
         self.update_status()
@@ -396,52 +474,147 @@ All processing happens locally via Ollama — your data stays private.
             self.music_btn.config(text=music_text)
         
         # ✅ 修复：更新角色列表时使用正确参数
-        role_names = [
-            self.agent.get_persona_name(new_lang, "nova"),
-            self.agent.get_persona_name(new_lang, "byte"),
-            self.agent.get_persona_name(new_lang, "muse"),
-            self.agent.get_persona_name(new_lang, "oracle")
-        ]
+        role_names = self.personas.display_names(new_lang)
         self.role_combo.config(values=role_names)
         self.role_combo.set(self.agent.get_persona_name(new_lang))
+        for session in self.sessions:
+            self._update_tab_title(session)
     
     def on_role_change(self, event=None):
         selection = self.role_var.get()
-        # 通过显示名称反推 persona ID（多语言安全映射）
-        persona_map = {
-            "zh": {
-                "Nova • 全能助手": "nova",
-                "Byte • 代码专家": "byte", 
-                "Muse • 创意写手": "muse",
-                "Oracle • 战略顾问": "oracle"
-            },
-            "en": {
-                "Nova • General Assistant": "nova",
-                "Byte • Code Expert": "byte",
-                "Muse • Creative Writer": "muse",
-                "Oracle • Strategy Advisor": "oracle"
-            }
-        }
-        persona_id = persona_map.get(self.current_lang, {}).get(selection, "nova")
+        # 通过显示名称反推 persona ID（注册表已按各语言名称建好索引）
+        persona_id = self.personas.from_display_name(selection)
+        self.session.cancel_prefill()
+        if self.session.streaming:
+            self.role_combo.set(self.agent.get_persona_name(self.current_lang))
+            return
         self.agent.switch_persona(persona_id)
+        self.session.rendered_nodes = []
+        self._update_tab_title(self.session)
         msg = f"Switched to: {selection}" if self.current_lang == "en" else f"已切换至: {selection}"
         self._append_message("System", msg, is_user=False)
     
+    def on_input_key(self, event=None):
+        """输入停顿时让服务端预先评估 system + 历史 + 草稿，发送后只需评估新增部分"""
+        if self.settings.get("prefill_while_typing"):
+            draft = self.input_box.get("1.0", tk.END).strip()
+            self.session.schedule_prefill(draft, PREFILL_DELAY_MS)
+    
+    def on_paste(self, event=None):
+        """大段粘贴直接写入磁盘作为附件，不塞进输入框"""
+        try:
+            text = self.root.clipboard_get()
+        except tk.TclError:
+            return None
+        if len(text) < ATTACH_THRESHOLD:
+            return None  # 交给 Text 默认处理
+        self.set_attachment(spool_text(text))
+        return "break"
+    
+    def set_attachment(self, attachment):
+        self.session.attachment = attachment
+        self._update_attach_label()
+    
+    def add_image(self, path):
+        """后台编码图片，编码完成前可以继续输入；发送时随消息一起提交"""
+        session = self.session
+        image = self.image_encoder.submit(path)
+        session.images.append(image)
+        self._update_attach_label()
+        image.future.add_done_callback(lambda f: self.root.after(0, lambda: self._on_image_encoded(session, image)))
+    
+    def _on_image_encoded(self, session, image):
+        if image.error is not None and image in session.images:
+            session.images.remove(image)
+            en = self.current_lang == "en"
+            session.append_message("System", f"❌ Image failed: {image.error}" if en else f"❌ 图片处理失败: {image.error}",
+                                   is_user=False)
+        if session is self.session:
+            self._update_attach_label()
+    
+    def clear_attachments(self):
+        self.session.images = []
+        self.set_attachment(None)
+    
+    def _update_attach_label(self):
+        session = self.session
+        labels = [session.attachment.label()] if session.attachment else []
+        labels += [image.label() for image in session.images]
+        self.attach_label.config(text="  ".join(labels) + "  ✕" if labels else "")
+    
     def on_send_key(self, event):
         self.on_send()
         return "break"
     
     def on_send(self):
+        with tracer.span("ui.on_send", "ui"):
+            self._handle_send()
+    
+    def _handle_send(self):
         message = self.input_box.get("1.0", tk.END).strip()
-        if not message:
+        attachment = self.session.attachment
+        images = self.session.images
+        if (not message and not attachment and not images) or self.session.streaming or self.session.pending():
             return
+        self.session.cancel_prefill()
         
         if message == "/clear":
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.delete("1.0", tk.END)
-            self.chat_display.config(state=tk.DISABLED)
             self.input_box.delete("1.0", tk.END)
-            self.agent.clear_history()
+            self.session.clear()
+            return
+        
+        if message in ("/new", "/close"):
+            self.input_box.delete("1.0", tk.END)
+            if message == "/new":
+                self.new_session()
+            else:
+                self.close_session(self.session)
+            return
+        
+        if message.startswith("/index"):
+            self.input_box.delete("1.0", tk.END)
+            self.start_indexing(message[len("/index"):].strip())
+            return
+        
+        if message.startswith("/attach"):
+            self.input_box.delete("1.0", tk.END)
+            path = message[len("/attach"):].strip()
+            try:
+                self.set_attachment(attach_file(path))
+            except OSError:
+                en = self.current_lang == "en"
+                self._append_message("System", "Usage: /attach <file>" if en else "用法: /attach <文件>", is_user=False)
+            return
+        
+        if message.startswith("/image"):
+            self.input_box.delete("1.0", tk.END)
+            try:
+                self.add_image(message[len("/image"):].strip())
+            except OSError:
+                en = self.current_lang == "en"
+                self._append_message("System", "Usage: /image <file>" if en else "用法: /image <图片文件>", is_user=False)
+            return
+        
+        if message == "/trace":
+            self.input_box.delete("1.0", tk.END)
+            self.toggle_trace()
+            return
+        
+        if message == "/router":
+            self.input_box.delete("1.0", tk.END)
+            self.show_router_stats()
+            return
+        
+        if message and message.split(maxsplit=1)[0] in ("/regen", "/edit", "/branches", "/branch"):
+            self.input_box.delete("1.0", tk.END)
+            self.on_branch_command(message)
+            return
+        
+        if any(not image.ready for image in images):
+            self.root.after(50, self.on_send)  # 图片仍在编码，稍后自动发送
+            return
+        images = [image for image in images if image.error is None]
+        if not message and not attachment and not images:
             return
         
         # 播放发送音效
@@ -450,64 +623,244 @@ All processing happens locally via Ollama — your data stays private.
         
         # 显示用户消息
         self.input_box.delete("1.0", tk.END)
-        self._append_message("You", message, is_user=True)
+        # 图片以 base64 存进节点的 JSON 片段，之后每轮请求直接复用，不再重新编码
+        payloads = [image.payload() for image in images] or None
+        labels = "".join(f"\n{image.label()}" for image in images)
+        self.session.images = []
+        if attachment:
+            # 附件只在消息里留一个标记，内容按块从磁盘读取
+            question = message or ("Summarize this document." if self.current_lang == "en" else "总结这份文档。")
+            node = self.agent.add_user_message(f"{question}\n{attachment.label()}{labels}", payloads)
+            self.session.attached[node.id] = (attachment, question)
+            self.set_attachment(None)
+        else:
+            question = None
+            if not message:
+                message = "Describe this image." if self.current_lang == "en" else "描述这张图片。"
+            node = self.agent.add_user_message(message + labels, payloads)
+            self._update_attach_label()
+        self.session.render_node(node)
+        self.start_reply(node, attachment, question)
+    
+    def start_reply(self, parent, attachment=None, question=None):
+        """为 parent 用户消息生成回复（异步流式，事件发布到本轮的事件总线）"""
+        session = self.session
+        session.begin_stream_message(session.agent.get_persona_name(self.current_lang))
+        session.streaming = True
+        
+        # 工作线程只管发布；渲染与音效各自订阅，慢消费者不会拖住 socket 读取
+        bus = EventBus()
+        session.listen(bus)
+        if self.settings.get("music_enabled") and hasattr(self, 'music_player') and self.music_player.enabled:
+            bus.consume(self._on_reply_event, DROP, "sound")
         
         # AI回复（异步）
+        t_spawn = tracer.now()
         def ai_thread():
-            def stream_callback(token, is_done):
-                if is_done:
-                    self.root.after(0, lambda: self.send_btn.config(state=tk.NORMAL))
-                    self.root.after(0, lambda: self.send_btn.config(
-                        text=self.i18n[self.current_lang]["send_btn"]
-                    ))
+            tracer.complete("ui.thread_start", t_spawn, tracer.now(), "ui")
+            try:
+                if attachment is not None:
+                    progress = lambda phase, done, total: bus.publish(
+                        "progress", self._progress_text(attachment, phase, done, total))
+                    _, node = session.agent.reply_attachment(bus.callback(), parent, attachment, question, progress,
+                                                             self.settings.get("map_parallel", 2))
                 else:
-                    self._append_stream_token(token)
-            
-            self.agent.chat(message, stream_callback)
-            
-            # 播放回复音效
-            if self.settings.get("music_enabled") and hasattr(self, 'music_player') and self.music_player.enabled:
-                self.root.after(100, lambda: self.music_player.play_sound("reply"))
+                    _, node = session.agent.reply(bus.callback(), parent)
+                if node is not None:
+                    bus.publish("bind", node)
+            except Exception as e:
+                # 例如附件文件已被删除：结束本轮，不让标签页一直停在生成中
+                bus.publish("done", f"❌ AI error: {e}")
+            finally:
+                bus.close()
         
         threading.Thread(target=ai_thread, daemon=True).start()
-        self.send_btn.config(state=tk.DISABLED)
-        self.send_btn.config(text="..." if self.current_lang == "en" else "思考中...")
-    
-    def _append_stream_token(self, token):
-        """流式追加token（线程安全）"""
-        def update():
-            self.chat_display.config(state=tk.NORMAL)
-            self.chat_display.insert(tk.END, token)
-            if self.settings.get("auto_scroll", True):
-                self.chat_display.see(tk.END)
-            self.chat_display.config(state=tk.DISABLED)
-        self.root.after(0, update)
+        self._update_send_button()
+    
+    def _progress_text(self, attachment, phase, done, total):
+        if self.current_lang == "en":
+            if phase == "map":
+                return f"Reading {attachment.name}: {done}/{total} parts"
+            return f"Merging notes: {done}/{total}"
+        if phase == "map":
+            return f"正在阅读 {attachment.name}：{done}/{total} 块"
+        return f"正在合并要点：{done}/{total}"
+    
+    def _on_reply_event(self, kind, payload):
+        """音效订阅者：回复成功结束时播放提示音"""
+        if kind == "done" and not payload:
+            self.root.after(100, lambda: self.music_player.play_sound("reply"))
+    
+    def new_session(self):
+        """新建聊天标签页（共用同一个后端）"""
+        session = ChatSession(self, self.notebook, AgentCore(backend=self.backend))
+        session.on_done = lambda s: self._update_send_button()
+        self.sessions.append(session)
+        self.notebook.add(session.frame)
+        self._update_tab_title(session)
+        self.notebook.select(session.frame)
+        self.on_tab_change()
+        return session
+    
+    def close_session(self, session):
+        if len(self.sessions) <= 1:
+            return  # 至少保留一个标签页
+        self.sessions.remove(session)
+        self.notebook.forget(session.frame)
+        session.frame.destroy()
+    
+    def _update_tab_title(self, session):
+        name = session.agent.get_persona_name(self.current_lang).split("•")[0].strip()
+        self.notebook.tab(session.frame, text=f"{name} #{self.sessions.index(session) + 1}")
+    
+    def on_tab_change(self, event=None):
+        current = self.session
+        for session in self.sessions:
+            session.cancel_prefill()
+        # 后台期间缓冲的输出一次画完，之后的发送不会和旧回复交错
+        current.drain(float("inf"))
+        current.sync()
+        self._update_attach_label()
+        self.role_combo.set(current.agent.get_persona_name(self.current_lang))
+        self._update_send_button()
+    
+    def _update_send_button(self):
+        if self.session.streaming:
+            self.send_btn.config(state=tk.DISABLED, text="..." if self.current_lang == "en" else "思考中...")
+        else:
+            self.send_btn.config(state=tk.NORMAL, text=self.i18n[self.current_lang]["send_btn"])
+    
+    def _render_tick(self):
+        """统一渲染循环：只有可见标签页在每帧预算内渲染 token；后台标签页只处理结束与绑定事件"""
+        current = self.session
+        for session in self.sessions:
+            if session is not current:
+                session.sync()
+        if current.pending():
+            current.drain(time.perf_counter() + RENDER_BUDGET)
+        if not current.pending():
+            current.sync()  # 可见标签页画完本轮才结束，新一轮不会和旧回复交错
+        self.root.after(FRAME_MS, self._render_tick)
+    
+    def _update_lag_gauge(self):
+        """延迟指示器：显示最近一个刷新周期内的最大事件循环延迟"""
+        lag = self.watchdog.take_max()
+        over = lag >= self.watchdog.threshold
+        self.lag_label.config(
+            text=f"⏱ {lag * 1000:.0f} ms" + (f"  ⚠ {self.watchdog.stalls}" if self.watchdog.stalls else ""),
+            fg=self.colors["status_offline"] if over else self.colors["muted"]
+        )
+        self.root.after(LAG_GAUGE_MS, self._update_lag_gauge)
+    
+    def on_branch_command(self, message):
+        """分支命令：/regen 重新生成，/edit 改写上一问，/branches 列出分支，/branch n 切换"""
+        en = self.current_lang == "en"
+        command, _, arg = message.partition(" ")
+        arg = arg.strip()
+        
+        if command == "/regen":
+            node = self.agent.regenerate_target()
+            if node is None:
+                return
+            self.session.show_path()
+            attachment, question = self.session.attached.get(node.id, (None, None))
+            self.start_reply(node, attachment, question)
+        elif command == "/edit":
+            if not arg:
+                self._append_message("System", "Usage: /edit <new message>" if en else "用法: /edit <新消息>", is_user=False)
+                return
+            old = self.agent.edit_target()
+            if old is None:
+                return
+            self.session.show_path()
+            # 改写带附件/图片的提问时沿用原来的附件与图片，只替换问题
+            attachment, _ = self.session.attached.get(old.id, (None, None))
+            images = old.images or None
+            labels = "".join(f"\n{line}" for line in old.content.split("\n") if line.startswith("🖼 "))
+            if attachment is not None:
+                node = self.agent.add_user_message(f"{arg}\n{attachment.label()}{labels}", images)
+                self.session.attached[node.id] = (attachment, arg)
+            else:
+                node = self.agent.add_user_message(arg + labels, images)
+            self.session.render_node(node)
+            self.start_reply(node, attachment, arg if attachment is not None else None)
+        elif command == "/branches":
+            head = self.agent.tree.head
+            lines = []
+            for i, leaf in enumerate(self.agent.tree.leaves(), 1):
+                current = head is not None and leaf.descends_from(head)
+                question = leaf if leaf.role == "user" else leaf.parent
+                preview = question.content.replace("\n", " ")[:40] if question else ""
+                lines.append(f"{'▶' if current else ' '} {i}. {preview}")
+            usage = "/branch <n> to switch" if en else "/branch <n> 切换分支"
+            self._append_message("System", "\n".join(lines + ["", usage]) if lines else usage, is_user=False)
+        elif command == "/branch":
+            if arg.isdigit() and self.agent.switch_branch(int(arg)):
+                self.session.show_path()
+            else:
+                self._append_message("System", "Usage: /branch <n>" if en else "用法: /branch <序号>", is_user=False)
+    
+    def toggle_trace(self):
+        """/trace：开始记录；再次输入则导出 Chrome trace 文件"""
+        en = self.current_lang == "en"
+        if not tracer.enabled:
+            tracer.start()
+            msg = "Tracing started. Type /trace again to save." if en else "已开始追踪，再次输入 /trace 导出。"
+        else:
+            tracer.stop()
+            path = Path.home() / ".newhorizon" / "traces" / f"trace-{int(time.time())}.json"
+            tracer.export_chrome(path)
+            msg = (f"Trace saved: {path}\nOpen it in chrome://tracing or ui.perfetto.dev" if en else
+                   f"追踪已导出: {path}\n可在 chrome://tracing 或 ui.perfetto.dev 打开")
+        self._append_message("System", msg, is_user=False)
+    
+    def show_router_stats(self):
+        """/router：级联路由各档位的请求数、升级原因与平均延迟"""
+        en = self.current_lang == "en"
+        router = self.backend.backend
+        if not isinstance(router, CascadeRouter):
+            msg = ("Cascade routing is off (set cascade_routing in config.json)." if en else
+                   "未开启级联路由（在 config.json 中设置 cascade_routing）。")
+            self._append_message("System", msg, is_user=False)
+            return
+        stats = router.stats()
+        lines = ["Routed:" if en else "路由："]
+        lines += [f"  {key}: {n}" for key, n in sorted(stats["routed"].items())]
+        lines.append("Escalated:" if en else "升级：")
+        lines += [f"  {reason}: {n}" for reason, n in sorted(stats["escalated"].items())]
+        lines.append("Mean latency (s):" if en else "平均延迟（秒）：")
+        lines += [f"  {key}: {value}" for key, value in sorted(stats["latency"].items())]
+        self._append_message("System", "\n".join(lines), is_user=False)
+    
+    def start_indexing(self, root):
+        """后台索引本地目录（Byte 角色对话时自动检索）"""
+        en = self.current_lang == "en"
+        if not root or not Path(root).expanduser().is_dir():
+            self._append_message("System", "Usage: /index <directory>" if en else "用法: /index <目录>", is_user=False)
+            return
+        root = str(Path(root).expanduser())
+        self._append_message("System", f"Indexing {root} ..." if en else f"正在索引 {root} ...", is_user=False)
+        session = self.session
+        
+        def index_thread():
+            try:
+                index = session.agent.open_index(root, self.settings.get("embed_model"))
+                count = index.update()
+                msg = (f"Index ready: {index.file_count} files, {count} chunks updated" if en else
+                       f"索引完成：{index.file_count} 个文件，更新 {count} 个片段")
+            except Exception as e:
+                session.agent.index = None
+                msg = f"❌ Index failed: {e}" if en else f"❌ 索引失败: {e}"
+            self.root.after(0, lambda: session.append_message("System", msg, is_user=False))
+        
+        threading.Thread(target=index_thread, daemon=True).start()
     
     def _append_message(self, sender, text, is_user=False):
-        self.chat_display.config(state=tk.NORMAL)
-        
-        prefix = f"\n{'▌ ' if is_user else '│ '}{sender}\n"
-        prefix_color = self.colors["user_msg"] if is_user else self.colors["ai_msg"]
-        
-        self.chat_display.insert(tk.END, prefix)
-        self.chat_display.tag_add("sender", "end-2c linestart", "end-1c")
-        self.chat_display.tag_config("sender", foreground=prefix_color, font=self.font_main)
-        
-        self.chat_display.insert(tk.END, f"{text}\n\n")
-        self.chat_display.tag_add("content", "end-3c linestart", "end-2c")
-        self.chat_display.tag_config("content", 
-                                   foreground=self.colors["text"],
-                                   lmargin1=24,
-                                   lmargin2=24)
-        
-        if self.settings.get("auto_scroll", True):
-            self.chat_display.see(tk.END)
-        
-        self.chat_display.config(state=tk.DISABLED)
+        self.session.append_message(sender, text, is_user)
     
     def show_welcome(self):
         # 显示Ollama状态提示
         status_tip = ("\n\n💡 Ollama提示: 请先运行 'ollama serve' 并下载模型（如 qwen2.5:7b）"
-                     if not self.agent.backend.is_available else "")
+                     if not self.backend.is_available else "")
         welcome_msg = self.i18n[self.current_lang]["welcome"] + status_tip
         self._append_message("System", welcome_msg, is_user=False)
\ No newline at end of file
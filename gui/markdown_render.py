@@ -0,0 +1,150 @@
+import re
+import tkinter as tk
+
+
+FENCE_RE = re.compile(r"^\s*(```|~~~)\s*([\w+#.-]*)")
+HEADING_RE = re.compile(r"^(#{1,6})\s")
+LIST_RE = re.compile(r"^(\s*)([-*+]|\d+[.)])\s")
+INLINE_CODE_RE = re.compile(r"`[^`]*`?")
+
+KEYWORDS = {
+    "python": {"def", "class", "return", "if", "elif", "else", "for", "while", "in", "not", "and", "or",
+               "import", "from", "as", "with", "try", "except", "finally", "raise", "yield", "lambda",
+               "pass", "break", "continue", "None", "True", "False", "self", "async", "await", "is", "global"},
+    "c": {"int", "char", "void", "float", "double", "long", "short", "unsigned", "struct", "enum", "const",
+          "static", "return", "if", "else", "for", "while", "do", "switch", "case", "break", "continue",
+          "class", "public", "private", "protected", "new", "delete", "true", "false", "null", "nullptr",
+          "function", "var", "let", "import", "export", "from", "package", "func", "fn", "mut", "impl",
+          "use", "pub", "interface", "extends", "implements", "this", "async", "await", "type", "go"},
+    "shell": {"if", "then", "else", "fi", "for", "do", "done", "while", "case", "esac", "function",
+              "echo", "export", "sudo", "cd", "return"},
+}
+LANG_FAMILY = {
+    "python": "python", "py": "python", "python3": "python",
+    "sh": "shell", "bash": "shell", "shell": "shell", "zsh": "shell", "console": "shell",
+}
+CODE_TOKEN_RE = re.compile(
+    r"(?P<comment>#.*$|//.*$)"
+    r"|(?P<string>\"(?:\\.|[^\"\\])*\"?|'(?:\\.|[^'\\])*'?)"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)"
+    r"|(?P<word>\b[A-Za-z_]\w*\b)"
+)
+
+MD_TAGS = ("md_h1", "md_h2", "md_h3", "md_marker", "md_list", "md_code", "md_fence",
+           "hl_keyword", "hl_string", "hl_comment", "hl_number")
+
+
+def style_code_line(line, lang):
+    """代码块单行高亮，返回 [(tag, 起点, 终点)]"""
+    family = LANG_FAMILY.get(lang.lower(), "c")
+    keywords = KEYWORDS[family]
+    spans = []
+    for m in CODE_TOKEN_RE.finditer(line):
+        kind = m.lastgroup
+        if kind == "comment":
+            # C 家族不用 # 注释（#include 等），shell/python 不用 //
+            if (m.group().startswith("#") and family == "c") or (m.group().startswith("//") and family != "c"):
+                continue
+            spans.append(("hl_comment", m.start(), m.end()))
+        elif kind == "string":
+            spans.append(("hl_string", m.start(), m.end()))
+        elif kind == "number":
+            spans.append(("hl_number", m.start(), m.end()))
+        elif m.group() in keywords:
+            spans.append(("hl_keyword", m.start(), m.end()))
+    return spans
+
+
+def style_line(line, in_fence, lang):
+    """按行首状态计算一行的样式区间"""
+    if FENCE_RE.match(line):
+        return [("md_marker", 0, len(line))]
+    if in_fence:
+        return [("md_fence", 0, len(line))] + style_code_line(line, lang)
+
+    spans = []
+    m = HEADING_RE.match(line)
+    if m:
+        level = min(len(m.group(1)), 3)
+        spans.append(("md_marker", 0, m.end()))
+        spans.append((f"md_h{level}", m.end(), len(line)))
+        return spans
+    m = LIST_RE.match(line)
+    if m:
+        spans.append(("md_list", m.start(2), m.end(2)))
+    for m in INLINE_CODE_RE.finditer(line):
+        spans.append(("md_code", m.start(), m.end()))
+    return spans
+
+
+class StreamingMarkdown:
+    """流式 Markdown 渲染 - 跨 token 保留解析状态，只重绘未完成的最后一行"""
+
+    def __init__(self, text, base_tags=()):
+        self.text = text
+        self.base_tags = tuple(base_tags)
+        self.in_fence = False
+        self.fence_lang = ""
+        self.line = ""
+        self.mark = f"md_tail_{id(self)}"
+        self.text.mark_set(self.mark, "end-1c")
+        self.text.mark_gravity(self.mark, tk.LEFT)
+
+    @staticmethod
+    def configure_tags(text, colors, chat_font):
+        """配置 Markdown 相关 tag（主题切换后重新调用）"""
+        family = chat_font.actual("family")
+        size = chat_font.actual("size")
+        text.tag_config("md_h1", font=(family, size + 4, "bold"), foreground=colors["ai_msg"])
+        text.tag_config("md_h2", font=(family, size + 2, "bold"), foreground=colors["ai_msg"])
+        text.tag_config("md_h3", font=(family, size, "bold"), foreground=colors["ai_msg"])
+        text.tag_config("md_marker", foreground=colors["muted"])
+        text.tag_config("md_list", foreground=colors["accent"])
+        text.tag_config("md_code", background=colors["code_bg"], foreground=colors["code_text"])
+        text.tag_config("md_fence", background=colors["code_bg"])
+        text.tag_config("hl_keyword", foreground=colors["hl_keyword"])
+        text.tag_config("hl_string", foreground=colors["hl_string"])
+        text.tag_config("hl_comment", foreground=colors["hl_comment"])
+        text.tag_config("hl_number", foreground=colors["hl_number"])
+        for tag in ("hl_keyword", "hl_string", "hl_comment", "hl_number"):
+            text.tag_raise(tag, "md_fence")
+
+    def feed(self, token):
+        """追加一段 token（需在 Tk 线程调用）"""
+        parts = token.split("\n")
+        for i, part in enumerate(parts):
+            if part:
+                self.text.insert("end-1c", part, self.base_tags)
+                self.line += part
+            if i < len(parts) - 1:
+                self._restyle_tail()
+                self._finish_line()
+                self.text.insert("end-1c", "\n", self.base_tags)
+                self.text.mark_set(self.mark, "end-1c")
+        if parts[-1]:
+            self._restyle_tail()
+
+    def finish(self):
+        """回复结束：收尾最后一行并释放标记"""
+        if self.line:
+            self._restyle_tail()
+            self._finish_line()
+        self.text.mark_unset(self.mark)
+
+    def _restyle_tail(self):
+        # 只重绘当前行：代价只和行长有关，与整条回复长度无关
+        start = self.mark
+        for tag in MD_TAGS:
+            self.text.tag_remove(tag, start, "end-1c")
+        for tag, s, e in style_line(self.line, self.in_fence, self.fence_lang):
+            if s < e:
+                self.text.tag_add(tag, f"{start}+{s}c", f"{start}+{e}c")
+
+    def _finish_line(self):
+        m = FENCE_RE.match(self.line)
+        if m:
+            if self.in_fence:
+                self.in_fence, self.fence_lang = False, ""
+            else:
+                self.in_fence, self.fence_lang = True, m.group(2)
+        self.line = ""
@@ -372,7 +372,9 @@ class SettingsDialog:
         lang_display = self.lang_var.get()
         lang_code = lang_display.split("•")[0].strip()
         
+        # 在现有设置上合并，只在 config.json 里配置的项（级联路由、工作进程等）保持不变
         new_settings = {
+            **self.settings_mgr.settings,
             "theme": self.theme_var.get(),
             "font_size": self.fontsize_var.get(),
             "model": self.model_var.get(),
@@ -0,0 +1,103 @@
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from pathlib import Path
+from core.tracing import tracer
+
+
+class EventLoopWatchdog:
+    """Tk 事件循环看门狗 - 心跳测量卡顿，超过阈值时由辅助线程采样主线程调用栈
+
+    心跳：主线程每 interval 毫秒执行一次 after 回调，实际间隔与预期之差即事件循环延迟
+    采样：辅助线程发现心跳停止超过阈值后，定期抓取主线程栈，卡顿结束时写入日志
+    """
+
+    def __init__(self, root, interval_ms=50, threshold_ms=200, sample_ms=20, log_path=None):
+        self.root = root
+        self.interval = interval_ms / 1000.0
+        self.threshold = threshold_ms / 1000.0
+        self.sample_interval = sample_ms / 1000.0
+        self.log_path = Path(log_path) if log_path else Path.home() / ".newhorizon" / "stalls.log"
+        self.main_thread_id = threading.get_ident()  # 须在 Tk 线程中创建
+        self.lag = 0.0          # 最近一次心跳的延迟（秒）
+        self.stalls = 0
+        self._window_max = 0.0
+        self._last_beat = time.perf_counter()
+        self._expected = None
+        self._after_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._last_beat = time.perf_counter()
+        self._expected = None
+        self._after_id = self.root.after(int(self.interval * 1000), self._heartbeat)
+        self._thread = threading.Thread(target=self._monitor, name="tk-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def take_max(self):
+        """读取并重置自上次读取以来的最大延迟（供延迟指示器使用）"""
+        value, self._window_max = max(self._window_max, self.lag), 0.0
+        return value
+
+    def _heartbeat(self):
+        now = time.perf_counter()
+        if self._expected is not None:
+            self.lag = max(0.0, now - self._expected)
+            self._window_max = max(self._window_max, self.lag)
+        self._last_beat = now
+        self._expected = now + self.interval
+        self._after_id = self.root.after(int(self.interval * 1000), self._heartbeat)
+
+    def _monitor(self):
+        while not self._stop.wait(self.sample_interval):
+            beat = self._last_beat
+            if time.perf_counter() - beat - self.interval < self.threshold:
+                continue
+            # 进入卡顿：持续采样直到下一次心跳
+            samples = Counter()
+            first = None
+            while self._last_beat == beat and not self._stop.is_set():
+                stack = self._sample_main_stack()
+                if stack:
+                    first = first or stack
+                    samples[stack] += 1
+                time.sleep(self.sample_interval)
+            duration = self._last_beat - beat - self.interval
+            self.stalls += 1
+            self._write_report(beat, duration, first, samples)
+
+    def _sample_main_stack(self):
+        frame = sys._current_frames().get(self.main_thread_id)
+        if frame is None:
+            return None
+        return "".join(traceback.format_stack(frame))
+
+    def _write_report(self, beat, duration, first, samples):
+        if tracer.enabled:
+            start_ns = int((beat + self.interval) * 1e9)  # perf_counter 与 tracer 同一时基
+            tracer.complete("ui.stall", start_ns, start_ns + int(duration * 1e9), "ui", samples=sum(samples.values()))
+        lines = [f"=== Tk stall {time.strftime('%Y-%m-%d %H:%M:%S')}  duration={duration * 1000:.0f}ms  "
+                 f"samples={sum(samples.values())}"]
+        if samples:
+            stack, hits = samples.most_common(1)[0]
+            lines.append(f"--- hottest stack ({hits}/{sum(samples.values())} samples)")
+            lines.append(stack.rstrip())
+            if first != stack:
+                lines.append("--- first sampled stack")
+                lines.append(first.rstrip())
+        try:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n\n")
+        except OSError:
+            pass
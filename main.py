@@ -2,9 +2,11 @@
 """NewHorizonDesign - 模块化入口"""
 
 from gui.main_window import NewHorizonDesignGUI
+from core.tracing import enable_from_env
 import tkinter as tk
 
 if __name__ == "__main__":
+    enable_from_env()
     root = tk.Tk()
     app = NewHorizonDesignGUI(root)
     root.mainloop()
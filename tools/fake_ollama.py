@@ -0,0 +1,232 @@
+"""内置 Ollama 替身 - 无需真实模型即可压测/回归测试
+
+模拟 /api/tags、/api/chat（NDJSON 流式，HTTP/1.1 分块传输）与 /api/embed：
+提示词评估耗时与输入长度成正比（与最近 prompt 的公共前缀视为已缓存），解码按固定 token 速率输出，
+并发槽位有限（类似 OLLAMA_NUM_PARALLEL），超出的请求排队。
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("the quick brown fox jumps over a lazy dog while local models stream tokens "
+         "into a small tkinter window and nobody waits too long").split()
+
+
+class FakeOllamaServer:
+    """可配置延迟的假 Ollama 服务"""
+
+    def __init__(self, host="127.0.0.1", port=0, prompt_chars_per_sec=20000.0, tokens_per_sec=60.0,
+                 reply_tokens=(20, 80), parallel=4, load_time=0.0, error_rate=0.0, seed=None, prefix_cache=True,
+                 drop_rate=0.0):
+        self.prompt_chars_per_sec = prompt_chars_per_sec
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.load_time = load_time
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate    # 流式输出中途断开连接的概率
+        self.slots = threading.Semaphore(parallel)
+        self.random = random.Random(seed)
+        self.requests = 0
+        # 模拟 llama.cpp 的 KV 前缀复用：每个槽位记住上次评估过的 prompt，只评估新增部分
+        self.prompt_cache = deque(maxlen=parallel) if prefix_cache else None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def uncached_chars(self, prompt):
+        """需要重新评估的字符数（与缓存中最长公共前缀之外的部分），并把本次 prompt 记入缓存"""
+        if self.prompt_cache is None:
+            return len(prompt)
+        with self._lock:
+            hit = max((len(os.path.commonprefix([prompt, cached])) for cached in self.prompt_cache), default=0)
+            self.prompt_cache.append(prompt)
+        return len(prompt) - hit
+
+    def reply_for(self, messages):
+        """按对话内容确定性地生成回复 token（同样的输入得到同样的输出）
+
+        最后一条是 assistant 消息时视为续写：只返回原回复中这段前缀之后的 token
+        """
+        if messages and messages[-1].get("role") == "assistant":
+            prefix = messages[-1].get("content", "")
+            tokens = self.reply_for(messages[:-1])
+            produced = ""
+            for i, token in enumerate(tokens):
+                if produced == prefix:
+                    return tokens[i:]
+                produced += token
+            return []
+        digest = hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+        rnd = random.Random(digest)
+        count = rnd.randint(*self.reply_tokens)
+        return [(" " if i else "") + rnd.choice(WORDS) for i in range(count)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "fake:latest"}]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length)
+                elif self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = self._read_chunked()
+                else:
+                    body = b""
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    self._send_json({"error": "invalid json"}, 400)
+                    return
+                with server._lock:
+                    server.requests += 1
+                if self.path == "/api/chat":
+                    self._chat(payload)
+                elif self.path == "/api/embed":
+                    self._embed(payload)
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def _read_chunked(self):
+                data = b""
+                while True:
+                    size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return data
+                    data += self.rfile.read(size)
+                    self.rfile.readline()
+
+            def _embed(self, payload):
+                texts = payload.get("input", [])
+                if isinstance(texts, str):
+                    texts = [texts]
+                vectors = []
+                for text in texts:
+                    digest = hashlib.sha256(text.encode("utf-8")).digest()
+                    vectors.append([b / 255.0 - 0.5 for b in digest])
+                self._send_json({"model": payload.get("model"), "embeddings": vectors})
+
+            def _chat(self, payload):
+                if server.random.random() < server.error_rate:
+                    self._send_json({"error": "simulated overload"}, 503)
+                    return
+                messages = payload.get("messages", [])
+                prompt_chars = sum(len(m.get("content", "")) for m in messages)
+                options = payload.get("options") or {}
+                tokens = server.reply_for(messages)
+                if options.get("num_predict", 0) > 0:
+                    tokens = tokens[:options["num_predict"]]
+
+                with server.slots:
+                    started = time.monotonic()
+                    load = 0.0
+                    with server._lock:
+                        if not server._loaded:
+                            load, server._loaded = server.load_time, True
+                    prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages)
+                    prompt_eval = server.uncached_chars(prompt) / server.prompt_chars_per_sec
+                    time.sleep(load + prompt_eval)
+
+                    if not payload.get("stream", True):
+                        time.sleep(len(tokens) / server.tokens_per_sec)
+                        self._send_json({"model": payload.get("model"), "done": True,
+                                         "message": {"role": "assistant", "content": "".join(tokens)},
+                                         "prompt_eval_count": prompt_chars // 4, "eval_count": len(tokens)})
+                        return
+
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    decode_start = time.monotonic()
+                    try:
+                        drop_at = (server.random.randrange(len(tokens))
+                                   if tokens and server.random.random() < server.drop_rate else None)
+                        for i, token in enumerate(tokens):
+                            if i == drop_at:
+                                self.close_connection = True
+                                return  # 不发结束分块，客户端读到连接中断
+                            time.sleep(1.0 / server.tokens_per_sec)
+                            line = {"model": payload.get("model"), "done": False,
+                                    "message": {"role": "assistant", "content": token}}
+                            self._write_chunk(json.dumps(line).encode("utf-8") + b"\n")
+                        now = time.monotonic()
+                        final = {"model": payload.get("model"), "done": True,
+                                 "message": {"role": "assistant", "content": ""},
+                                 "total_duration": int((now - started) * 1e9),
+                                 "load_duration": int(load * 1e9),
+                                 "prompt_eval_count": prompt_chars // 4,
+                                 "prompt_eval_duration": int(prompt_eval * 1e9),
+                                 "eval_count": len(tokens),
+                                 "eval_duration": int((now - decode_start) * 1e9)}
+                        self._write_chunk(json.dumps(final).encode("utf-8") + b"\n")
+                        self._write_chunk(b"")
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # 客户端中途断开
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tps", type=float, default=60.0, help="decode tokens per second")
+    parser.add_argument("--parallel", type=int, default=4)
+    args = parser.parse_args()
+    fake = FakeOllamaServer(port=args.port, tokens_per_sec=args.tps, parallel=args.parallel)
+    print(f"Fake Ollama listening on {fake.base_url}")
+    fake.httpd.serve_forever()
@@ -0,0 +1,283 @@
+"""GUI 渲染性能回归测试 - 在虚拟显示（Xvfb）里驱动真实的主窗口
+
+    python -m tools.guibench                        # 与 tools/guibench_baseline.json 比较
+    python -m tools.guibench --update-baseline      # 以本次结果作为新的基线
+    python -m tools.guibench --ci                   # CI：缺少基线也算失败
+    python -m tools.guibench --turns 10 --json out.json
+
+后端使用内置 Ollama 替身（真实 HTTP 流式），测量：
+  frame_p95_ms / frame_max_ms —— 流式输出期间事件循环每帧延迟（16ms 心跳的迟到量）
+  chars_per_sec              —— 多标签页并发流式时每秒写入聊天区的字符数（替身输出远快于渲染，测的是渲染吞吐）
+  memory_kb_per_turn         —— 长对话中每轮带来的常驻内存增长
+  scroll_ms                  —— 长对话里滚动一次（yview + 重绘）的耗时
+  settings_apply_ms          —— on_settings_applied 切换主题/语言的耗时
+任何指标超出基线容差即以退出码 1 结束，--ci 下缺少基线同样以 1 结束；没有显示环境时退出码 2。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASELINE = Path(__file__).with_name("guibench_baseline.json")
+
+# 各指标允许的相对退化幅度，以及数值越大越好还是越小越好
+TOLERANCE = {
+    "frame_p95_ms": (0.5, "lower"),
+    "frame_max_ms": (1.0, "lower"),
+    "chars_per_sec": (0.3, "higher"),
+    "memory_kb_per_turn": (0.5, "lower"),
+    "scroll_ms": (0.5, "lower"),
+    "settings_apply_ms": (0.5, "lower"),
+}
+# 绝对值很小时相对比例没有意义，低于这些下限的波动不算退化
+NOISE_FLOOR = {"frame_p95_ms": 4.0, "frame_max_ms": 20.0, "memory_kb_per_turn": 16.0,
+               "scroll_ms": 2.0, "settings_apply_ms": 10.0}
+
+
+def start_xvfb():
+    """没有 DISPLAY 时启动 Xvfb，返回 (进程, 显示号)；找不到 Xvfb 返回 (None, None)"""
+    xvfb = shutil.which("Xvfb")
+    if not xvfb:
+        return None, None
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen([xvfb, "-displayfd", str(write_fd), "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                            pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        display = f.readline().strip()
+    if not display:
+        proc.terminate()
+        return None, None
+    return proc, f":{display}"
+
+
+def rss_kb():
+    """当前进程常驻内存（KB）；Tk 的内存在 C 层，tracemalloc 看不到"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class FrameProbe:
+    """16ms 心跳，记录每次回调相对预期时刻的迟到量"""
+
+    def __init__(self, root, interval_ms=16):
+        self.root = root
+        self.interval = interval_ms / 1000.0
+        self.lags = []
+        self.running = False
+        self._expected = None
+
+    def start(self):
+        self.lags = []
+        self.running = True
+        self._expected = time.perf_counter() + self.interval
+        self.root.after(int(self.interval * 1000), self._beat)
+
+    def stop(self):
+        self.running = False
+        return self.lags
+
+    def _beat(self):
+        if not self.running:
+            return
+        now = time.perf_counter()
+        self.lags.append(max(0.0, now - self._expected) * 1000)
+        self._expected = now + self.interval
+        self.root.after(int(self.interval * 1000), self._beat)
+
+
+class GuiBench:
+    def __init__(self, app, turns, tabs):
+        self.app = app
+        self.root = app.root
+        self.turns = turns
+        self.tabs = tabs
+        self.probe = FrameProbe(self.root)
+
+    def pump_until(self, done, timeout=120.0):
+        """驱动 Tk 事件循环直到条件满足（与 mainloop 一样处理定时器和重绘）"""
+        deadline = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() > deadline:
+                raise TimeoutError("GUI did not finish streaming in time")
+            self.root.update()
+            time.sleep(0.001)
+
+    def idle(self):
+        return all(not s.streaming and not s.pending() for s in self.app.sessions)
+
+    def send(self, text):
+        self.app.input_box.delete("1.0", "end")
+        self.app.input_box.insert("1.0", text)
+        self.app.on_send()
+
+    def select(self, session):
+        self.app.notebook.select(session.frame)
+        self.app.on_tab_change()
+
+    def run(self):
+        app = self.app
+        self.send("warm up")
+        self.pump_until(self.idle)
+
+        # 1. 多标签页并发流式：帧延迟 + 渲染吞吐
+        while len(app.sessions) < self.tabs:
+            app.new_session()
+        counted = [len(s.chat_display.get("1.0", "end")) for s in app.sessions]
+        self.probe.start()
+        started = time.perf_counter()
+        for turn in range(self.turns):
+            for i, session in enumerate(app.sessions):
+                self.select(session)
+                self.send(f"tab {i} turn {turn}: explain streaming renderers")
+            # 后台标签页只缓冲不渲染（结束标记照常处理），逐个切过去把积压画完
+            for session in app.sessions:
+                self.select(session)
+                self.pump_until(lambda: not session.streaming and not session.pending())
+        elapsed = time.perf_counter() - started
+        lags = self.probe.stop()
+        grown = sum(len(s.chat_display.get("1.0", "end")) for s in app.sessions) - sum(counted)
+
+        # 2. 长对话内存增长
+        session = app.sessions[0]
+        self.select(session)
+        before = rss_kb()
+        for turn in range(self.turns * 4):
+            self.send(f"memory turn {turn}")
+            self.pump_until(self.idle)
+        memory_per_turn = (rss_kb() - before) / (self.turns * 4)
+
+        # 3. 长对话滚动
+        text = session.chat_display
+        scroll = []
+        for step in range(50):
+            t0 = time.perf_counter()
+            text.yview_moveto((step * 7 % 50) / 50)
+            self.root.update_idletasks()
+            scroll.append((time.perf_counter() - t0) * 1000)
+
+        # 4. 主题 / 语言切换
+        settings = app.settings.settings
+        applied = []
+        for theme, lang in (("light", "en"), ("dark", "zh"), ("light", "zh"), ("dark", "en"), ("dark", "zh")):
+            settings.update(theme=theme, language=lang)
+            t0 = time.perf_counter()
+            app.on_settings_applied(dict(settings))
+            self.root.update_idletasks()
+            applied.append((time.perf_counter() - t0) * 1000)
+
+        lags.sort()
+        return {
+            "frame_p95_ms": round(lags[int(len(lags) * 0.95)] if lags else 0.0, 2),
+            "frame_max_ms": round(lags[-1] if lags else 0.0, 2),
+            "chars_per_sec": round(grown / elapsed, 1),
+            "chars_rendered": grown,
+            "memory_kb_per_turn": round(memory_per_turn, 1),
+            "scroll_ms": round(statistics.median(scroll), 2),
+            "settings_apply_ms": round(statistics.median(applied), 2),
+        }
+
+
+def compare(results, baseline):
+    """返回退化的指标列表 [(名称, 当前值, 基线值, 容差)]"""
+    regressions = []
+    for name, (tolerance, better) in TOLERANCE.items():
+        if name not in baseline or name not in results:
+            continue
+        current, base = results[name], baseline[name]
+        if better == "lower":
+            limit = max(base * (1 + tolerance), base + NOISE_FLOOR.get(name, 0.0))
+            bad = current > limit
+        else:
+            limit = base * (1 - tolerance)
+            bad = current < limit
+        if bad:
+            regressions.append((name, current, base, limit))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GUI rendering performance regression suite")
+    parser.add_argument("--turns", type=int, default=5, help="streaming turns per tab")
+    parser.add_argument("--tabs", type=int, default=3, help="tabs streaming concurrently")
+    parser.add_argument("--fake-tps", type=float, default=20000.0,
+                        help="fake server decode tokens/s per stream (keep it far above render speed)")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--update-baseline", action="store_true", help="write this run's results as the baseline")
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    parser.add_argument("--ci", action="store_true", default=bool(os.environ.get("CI")),
+                        help="fail when no baseline exists (default when $CI is set)")
+    args = parser.parse_args(argv)
+
+    xvfb = None
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        xvfb, display = start_xvfb()
+        if xvfb is None:
+            print("No DISPLAY and Xvfb not found; install xvfb to run the GUI benchmark")
+            return 2
+        os.environ["DISPLAY"] = display
+
+    # 独立的 HOME：不读写用户自己的设置、角色与附件
+    home = tempfile.mkdtemp(prefix="nhd-guibench-")
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home
+
+    import tkinter as tk
+    from tkinter import messagebox
+    from core.ollama_backend import OllamaBackend
+    from gui.main_window import NewHorizonDesignGUI
+    from .fake_ollama import FakeOllamaServer
+
+    messagebox.showinfo = lambda *a, **k: None  # 语言切换会弹出模态提示，测试中不等待用户点击
+    fake = FakeOllamaServer(tokens_per_sec=args.fake_tps, reply_tokens=(80, 160), parallel=args.tabs, seed=1)
+    root = None
+    try:
+        fake.start()
+        root = tk.Tk()
+        app = NewHorizonDesignGUI(root, backend=OllamaBackend(base_url=fake.base_url, pool_maxsize=args.tabs))
+        root.update()
+        results = GuiBench(app, args.turns, args.tabs).run()
+    except tk.TclError as e:
+        print(f"Cannot open a display: {e}")
+        return 2
+    finally:
+        if root is not None:
+            root.destroy()
+        fake.stop()
+        if xvfb is not None:
+            xvfb.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+
+    for name, value in results.items():
+        print(f"{name:>20}: {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not Path(args.baseline).exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline on a known-good build")
+        return 1 if args.ci else 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    for name, current, base, limit in regressions:
+        print(f"REGRESSION {name}: {current} (baseline {base}, limit {limit:.2f})")
+    print("FAIL" if regressions else "PASS")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
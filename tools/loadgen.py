@@ -0,0 +1,171 @@
+"""并发会话压测 - 通过 AgentCore 模拟多个用户同时对话
+
+    python -m tools.loadgen                        # 使用内置 Ollama 替身
+    python -m tools.loadgen --url http://localhost:11434 --model qwen2.5:7b --levels 1,2,4
+    python -m tools.loadgen --url http://localhost:11434 --record cassettes/   # 录制
+    python -m tools.loadgen --replay cassettes/ --speed 4                      # 离线回放
+    python -m tools.loadgen --collapse             # 相同请求合并为一次生成
+
+每个模拟会话按指数分布的思考时间连续发送多轮消息，对话历史随轮数增长；
+按并发档位逐级加压，报告首 token 延迟 / 整轮延迟的 p50、p99，吞吐与错误率。
+"""
+import argparse
+import math
+import random
+import threading
+import time
+
+from core.agent import AgentCore
+from core.ollama_backend import OllamaBackend
+from core.cassette import ReplayBackend
+from core.singleflight import SingleFlightBackend
+from .fake_ollama import FakeOllamaServer
+
+PROMPTS = [
+    "Explain what a context manager is in Python.",
+    "Give me three names for a coffee shop on the moon.",
+    "How do I reverse a linked list?",
+    "Summarize the pros and cons of microservices.",
+    "Write a haiku about latency.",
+    "What should I check first when a web page loads slowly?",
+]
+
+
+def percentile(values, pct):
+    """最近秩百分位数"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class TurnResult:
+    def __init__(self, ttft, total, tokens, error):
+        self.ttft = ttft
+        self.total = total
+        self.tokens = tokens
+        self.error = error
+
+
+def run_session(backend, persona, turns, think_mean, rnd, results, lock):
+    """一个模拟用户：多轮对话，历史在同一棵对话树上增长"""
+    agent = AgentCore(backend=backend)
+    agent.switch_persona(persona)
+    for _ in range(turns):
+        if think_mean > 0:
+            time.sleep(rnd.expovariate(1.0 / think_mean))
+        state = {"first": None, "tokens": 0, "error": ""}
+        started = time.perf_counter()
+
+        def callback(token, is_done):
+            if is_done:
+                state["error"] = token
+            elif token:
+                if state["first"] is None:
+                    state["first"] = time.perf_counter()
+                state["tokens"] += 1
+
+        agent.chat(rnd.choice(PROMPTS), callback)
+        total = time.perf_counter() - started
+        ttft = state["first"] - started if state["first"] is not None else None
+        with lock:
+            results.append(TurnResult(ttft, total, state["tokens"], state["error"]))
+
+
+def run_level(backend, concurrency, turns, think_mean, persona, seed):
+    results = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_session, daemon=True,
+                         args=(backend, persona, turns, think_mean, random.Random(seed + i), results, lock))
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if not r.error]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    totals = [r.total for r in ok]
+    return {
+        "concurrency": concurrency,
+        "turns": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p99": percentile(ttfts, 99),
+        "turn_p50": percentile(totals, 50),
+        "turn_p99": percentile(totals, 99),
+        "turns_per_sec": len(ok) / elapsed if elapsed else 0.0,
+        "tokens_per_sec": sum(r.tokens for r in ok) / elapsed if elapsed else 0.0,
+    }
+
+
+HEADER = (f"{'conc':>5} {'turns':>6} {'err%':>6} {'ttft p50':>9} {'ttft p99':>9} "
+          f"{'turn p50':>9} {'turn p99':>9} {'turn/s':>7} {'tok/s':>8}")
+
+
+def format_row(r):
+    return (f"{r['concurrency']:>5} {r['turns']:>6} {r['error_rate'] * 100:>5.1f}% "
+            f"{r['ttft_p50']:>8.3f}s {r['ttft_p99']:>8.3f}s {r['turn_p50']:>8.3f}s {r['turn_p99']:>8.3f}s "
+            f"{r['turns_per_sec']:>7.2f} {r['tokens_per_sec']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load generator for NewHorizonDesign")
+    parser.add_argument("--url", help="real Ollama base URL (default: built-in fake server)")
+    parser.add_argument("--model", default="qwen2.5:7b")
+    parser.add_argument("--persona", default="nova")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma-separated concurrency ramp")
+    parser.add_argument("--turns", type=int, default=5, help="turns per simulated session")
+    parser.add_argument("--think", type=float, default=0.5, help="mean think time between turns (s)")
+    parser.add_argument("--fake-tps", type=float, default=80.0, help="fake server decode tokens/s")
+    parser.add_argument("--fake-parallel", type=int, default=4, help="fake server parallel slots")
+    parser.add_argument("--fake-drop", type=float, default=0.0, help="fake server mid-stream disconnect probability")
+    parser.add_argument("--record", metavar="DIR", help="save every stream as a cassette into DIR")
+    parser.add_argument("--replay", metavar="DIR", help="serve streams from cassettes in DIR instead of HTTP")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor (0 = no delays)")
+    parser.add_argument("--collapse", action="store_true", help="collapse identical in-flight requests (single-flight)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    fake = None
+    url = args.url
+    if args.replay:
+        backend = ReplayBackend(args.replay, speed=args.speed, model=args.model)
+        url = args.replay
+        print(f"Replaying {len(backend.cassettes)} cassettes from {url} at {args.speed}x")
+    else:
+        if not url:
+            fake = FakeOllamaServer(tokens_per_sec=args.fake_tps, parallel=args.fake_parallel, seed=args.seed,
+                                    drop_rate=args.fake_drop)
+            url = fake.start()
+            print(f"Using built-in fake Ollama at {url}")
+        backend = OllamaBackend(model=args.model, base_url=url, pool_maxsize=max(levels))
+        if args.record:
+            backend.start_recording(args.record)
+    if not backend.is_available:
+        print(f"Ollama not reachable at {url}")
+        return 1
+    if args.collapse:
+        backend = SingleFlightBackend(backend)
+    print(HEADER)
+    print("-" * len(HEADER))
+    try:
+        for level in levels:
+            print(format_row(run_level(backend, level, args.turns, args.think, args.persona, args.seed)), flush=True)
+    finally:
+        if fake:
+            fake.stop()
+    if args.collapse:
+        print(f"Collapsed {backend.collapsed} duplicate in-flight requests")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
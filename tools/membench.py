@@ -0,0 +1,97 @@
+"""对话历史内存基准 - 比较每 10 万轮的历史存储开销
+
+    python -m tools.membench
+    python -m tools.membench --turns 200000 --case cjk
+
+对比两种表示（均包含消息正文本身）：
+  dicts   —— 旧的 conversation_history：每轮一个 {"role", "content"} dict + str 正文
+  records —— 对话树里的 MessageNode：__slots__、驻留的 role/persona，正文为 str
+分别测量短英文、短中文（默认语言）与长消息三种情形
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from core.conversation import ConversationTree
+
+
+WORDS = {
+    "ascii": (["latency", "stream", "token", "persona", "branch", "context", "model", "cache"], " "),
+    "cjk": (["延迟", "流式输出", "令牌", "角色", "分支", "上下文", "模型", "缓存"], "，"),
+}
+# 情形 -> (词表, 每条消息约多少字符, 实测轮数占 --turns 的比例)
+CASES = {
+    "ascii": ("ascii", 200, 1.0),
+    "cjk": ("cjk", 200, 1.0),
+    "long": ("ascii", 4000, 0.1),
+}
+
+
+def make_texts(turns, chars, seed, words="ascii"):
+    rnd = random.Random(seed)
+    words, sep = WORDS[words]
+    texts = []
+    for _ in range(turns):
+        text = []
+        size = 0
+        while size < chars:
+            word = rnd.choice(words)
+            text.append(word)
+            size += len(word) + len(sep)
+        texts.append(sep.join(text))
+    return texts
+
+
+def measure(build):
+    """构建数据结构期间新增的内存（字节），构建结果保持存活直到计量结束"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del keep
+    return used
+
+
+def build_dicts(texts):
+    history = []
+    for i, text in enumerate(texts):
+        history.append({"role": "user" if i % 2 == 0 else "assistant", "content": text})
+    return history
+
+
+def build_records(texts):
+    tree = ConversationTree()
+    for i, text in enumerate(texts):
+        tree.append("user" if i % 2 == 0 else "assistant", text, "nova")
+    return tree
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory used by in-memory conversation history")
+    parser.add_argument("--turns", type=int, default=100000)
+    parser.add_argument("--case", choices=sorted(CASES), action="append", help="run only these cases")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{'case':>6}  {'layout':>8}  {'MB/100k turns':>14}  {'bytes/turn':>10}  {'vs dicts':>8}")
+    for case in args.case or list(CASES):
+        words, chars, share = CASES[case]
+        turns = max(1, int(args.turns * share))
+        # 正文在计量内生成，构建完成后只剩数据结构自己持有的那一份
+        texts = lambda: make_texts(turns, chars, args.seed, words)
+        results = [
+            ("dicts", measure(lambda: build_dicts(texts()))),
+            ("records", measure(lambda: build_records(texts()))),
+        ]
+        baseline = results[0][1]
+        for name, used in results:
+            print(f"{case:>6}  {name:>8}  {used * 100000 / turns / 1e6:14.1f}  {used / turns:10.0f}  "
+                  f"{used / baseline:8.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())